@@ -78,6 +78,10 @@ echo 'enable cron.target' > $RPM_BUILD_ROOT/usr/lib/systemd/system-preset/50-sys
 /usr/lib/systemd-cron/mail_on_failure
 /usr/lib/systemd-cron/boot_delay
 /usr/lib/systemd-cron/remove_stale_stamps
+/usr/lib/systemd-cron/update_units
+/usr/lib/systemd-cron/job_slot
+/usr/lib/systemd-cron/systemd_cron.py
+/usr/lib/systemd-cron/__pycache__/systemd_cron.*.pyc
 /usr/lib/systemd/system-preset/50-systemd-cron.preset
 /usr/lib/systemd/system/cron.target
 /usr/lib/systemd/system/cron-weekly.service
@@ -4,7 +4,6 @@ import argparse
 import errno
 import getpass
 import glob
-import importlib.machinery
 import os
 import pwd
 import stat
@@ -31,7 +30,7 @@ EDITOR = (os.environ.get('EDITOR') or
 SELF = os.path.basename(sys.argv[0])
 
 CRONTAB_DIR = '@statedir@'
-GENERATOR_DIR= '@generatordir@'
+LIB_DIR = '@libdir@/systemd-cron'
 SETGID_HELPER = '@libdir@/systemd-cron/crontab_setgid'
 
 HAS_SETGID =     os.geteuid() != 0 \
@@ -61,10 +60,16 @@ def blue(line:str) -> None:
         print(line)
 
 
+def load_parser():
+    '''the parser shared with the generator, from its precompiled bytecode'''
+    if LIB_DIR not in sys.path:
+        sys.path.insert(0, LIB_DIR)
+    import systemd_cron
+    return systemd_cron
+
+
 def translate(line:str, args) -> None:
-    loader = importlib.machinery.SourceFileLoader('name',
-                os.path.join(GENERATOR_DIR, 'systemd-crontab-generator'))
-    parser = loader.load_module()
+    parser = load_parser()
     line = args.file
     print(line)
 
@@ -85,23 +90,19 @@ def translate(line:str, args) -> None:
 
 def check(cron_file:str) -> bool:
     good = True
-    loader = importlib.machinery.SourceFileLoader('name',
-                os.path.join(GENERATOR_DIR, 'systemd-crontab-generator'))
-    parser = loader.load_module()
-    for job in parser.parse_crontab(cron_file, withuser=False):
+    parser = load_parser()
+    # when run as root, this also leaves the parsed jobs for the generator
+    for job in parser.parse_crontab_cached(cron_file):
         if not job.valid:
             good = False
             sys.stderr.write('%s: truncated line in %s: %s\n' % (SELF, cron_file, job.line))
-        elif type(job.period) is str:
+        elif job.period:
             if job.period not in ['reboot', 'minutely', 'hourly', 'daily', 'midnight', 'weekly',
                                 'monthly', 'quarterly',
                                 'semi-annually', 'semiannually', 'bi-annually', 'biannually',
                                 'annually', 'yearly']:
                 good = False
                 sys.stderr.write("%s: unknown schedule in %s: %s\n" % (SELF, cron_file, job.line))
-        elif '0' in job.timespec_month or '0' in job.timespec_day:
-                good = False
-                sys.stderr.write("%s: month and day can't be 0 in %s: %s\n" % (SELF, cron_file, job.line))
     return good
 
 
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+import fcntl
+import os
+import sys
+import time
+from typing import Optional
+
+__DOC__ = """ run a job once it holds one of the slots of its user, see MAX_JOBS in crontab(5) """
+
+try:
+    slots = int(sys.argv[1])
+    folder = sys.argv[2]
+    command = sys.argv[3:]
+    assert slots > 0 and command
+except (IndexError, ValueError, AssertionError):
+    sys.exit("Usage: %s <slots> <folder> <command> [args...]" % sys.argv[0])
+
+# how often the first waiting job looks for a free slot
+POLL = 0.5
+
+def free_slot() -> Optional[int]:
+    '''the locked file of the first slot nobody holds'''
+    for i in range(slots):
+        fd = os.open(os.path.join(folder, 'slot.%d' % i), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        # the lock is held by the job itself, until it exits
+        os.set_inheritable(fd, True)
+        return fd
+    return None
+
+fd = free_slot()
+if fd is None:
+    print('<5>the %d slots are all taken, waiting' % slots, flush=True)
+    # the other waiting jobs queue behind this one, instead of polling too
+    queue = os.open(os.path.join(folder, 'queue'), os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(queue, fcntl.LOCK_EX)
+    fd = free_slot()
+    while fd is None:
+        time.sleep(POLL)
+        fd = free_slot()
+    os.close(queue)
+
+os.execvp(command[0], command)
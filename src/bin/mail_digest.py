@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+import argparse
+import email.charset
+import email.mime.text
+import email.utils
+import json
+import os
+import subprocess
+import time
+
+__DOC__ = """ send the failures spooled by mail_on_failure --digest, one mail per recipient """
+
+SPOOL_DIR = '/run/systemd-cron/failures'
+STATE_FILE = '/run/systemd-cron/digest/sent.json'
+
+parser = argparse.ArgumentParser(description=__DOC__)
+parser.add_argument('--window', type=float, default=60, metavar='SECONDS',
+                    help='wait that long for more failures before sending')
+parser.add_argument('--rate', type=int, default=5, metavar='N',
+                    help='send at most N mails to a recipient...')
+parser.add_argument('--period', type=float, default=3600, metavar='SECONDS',
+                    help='...during that period, the failures are held meanwhile')
+args = parser.parse_args()
+
+hostname = os.uname()[1]
+
+def load_state() -> dict[str, list[float]]:
+    '''recipient -> when the last digests were sent'''
+    try:
+        with open(STATE_FILE, 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def save_state(state:dict[str, list[float]]) -> None:
+    try:
+        with open(STATE_FILE + '.new', 'w', encoding='utf8') as f:
+            json.dump(state, f)
+        os.rename(STATE_FILE + '.new', STATE_FILE)
+    except OSError as e:
+        print('<4>cannot save %s: %s' % (STATE_FILE, e))
+
+def spooled() -> dict[str, list[tuple[str, dict]]]:
+    '''recipient -> (path, failure), oldest first'''
+    failures = []
+    try:
+        entries = list(os.scandir(SPOOL_DIR))
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        if entry.name.startswith('.') or not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, 'r', encoding='utf8') as f:
+                failures.append((entry.path, json.load(f)))
+        except ValueError:
+            print('<4>dropping corrupt %s' % entry.path)
+            os.unlink(entry.path)
+        except OSError:
+            pass
+    failures.sort(key=lambda item: item[1]['time'])
+    recipients:dict[str, list[tuple[str, dict]]] = dict()
+    for path, failure in failures:
+        recipients.setdefault(failure['mailto'], []).append((path, failure))
+    return recipients
+
+def send(mailto:str, failures:list[dict]) -> None:
+    if len(failures) == 1:
+        subject = failures[0]['subject']
+        body = failures[0]['body']
+    else:
+        subject = '[%s] %d cron jobs failed' % (hostname, len(failures))
+        body = ''.join('%s\n%s\n\n%s\n\n' % (failure['unit'], '=' * len(failure['unit']), failure['body'])
+                       for failure in failures)
+
+    # see mail_on_failure
+    utf8_8bit = email.charset.Charset('utf-8')
+    utf8_8bit.body_encoding = None
+
+    message_object = email.mime.text.MIMEText(_text=body, _charset=utf8_8bit)
+    message_object['Date'] = email.utils.formatdate()
+    message_object['From'] = failures[0]['mailfrom'] + ' (systemd-cron)'
+    message_object['To'] = mailto
+    message_object['Subject'] = subject
+    message_object['Auto-Submitted'] = 'auto-generated'
+
+    subprocess.run(
+            ['sendmail',
+             '-i',
+             '-B8BITMIME',
+             mailto],
+            universal_newlines=False,
+            input=message_object.as_bytes(),
+            check=True)
+
+state = load_state()
+held:set[str] = set()
+# the failures of the held recipients stay spooled, and are looked at again each round
+while True:
+    # let the burst settle
+    time.sleep(args.window)
+
+    recipients = spooled()
+    if not recipients:
+        break
+
+    now = time.time()
+    for mailto, failures in recipients.items():
+        sent = [t for t in state.get(mailto, []) if t > now - args.period]
+        state[mailto] = sent
+        if len(sent) >= args.rate:
+            if mailto not in held:
+                print('<5>holding the failures for %s, %d mails were already sent in %ds' %
+                      (mailto, len(sent), args.period))
+                held.add(mailto)
+            continue
+        held.discard(mailto)
+        try:
+            send(mailto, [failure for _, failure in failures])
+        except subprocess.CalledProcessError as e:
+            print('<3>cannot send the failures to %s: %s' % (mailto, e))
+            continue
+        for path, _ in failures:
+            os.unlink(path)
+        sent.append(now)
+        print('<6>sent %d failures to %s' % (len(failures), mailto))
+    save_state(state)
@@ -1,94 +1,241 @@
 #!/usr/bin/python3
 import argparse
-import email.mime.text
+import collections
+import email.message
 import email.utils
+import io
+import json
 import logging
 import os
+import re
 import subprocess
+import time
 
 __DOC__ = """ send a panic email about a failed cron job """
 
+# everything needed from the unit, in a single query
+PROPERTIES = ['User', 'Environment', 'FragmentPath', 'InvocationID',
+              'Description', 'Result', 'ExecMainStatus', 'ExecMainExitTimestampMonotonic']
+# read by mail_digest
+SPOOL_DIR = '/run/systemd-cron/failures'
+
 parser = argparse.ArgumentParser(description=__DOC__)
 parser.add_argument('unit', help='the failing unit, e.g. cron-foo-1.service')
 parser.add_argument('--verbose', action='store_true')
-args = parser.parse_args()
-if args.verbose:
-    logging.getLogger().setLevel(logging.INFO)
-
-for pgm in ('/usr/sbin/sendmail', '/usr/lib/sendmail'):
-    if os.path.exists(pgm):
-        break
-else:
-    print("<3>can't send error mail for %s without a MTA" % args.unit)
-    exit(0)
-
-user = subprocess.check_output(
-                     ['systemctl', 'show', args.unit, '--property=User'],
-                     universal_newlines=True)
-user = user.rstrip('\n')
-user = user.split('=')[1]
-if not user:
-    user = 'root'
-
-mailto = user
-mailfrom = 'root'
-
-job_env = subprocess.check_output(
-                        ['systemctl', 'show', args.unit, '--property=Environment'],
-                        universal_newlines=True)
-job_env = job_env.rstrip('\n')
-
-if job_env:
-    for var in job_env.split('=', 1)[1].split(' '):
+parser.add_argument('--digest', action='store_true',
+                    help='leave the report to mail_digest instead of mailing it now')
+parser.add_argument('--head', type=int, default=0, metavar='LINES',
+                    help='first lines of the log to include')
+parser.add_argument('--tail', type=int, default=10, metavar='LINES',
+                    help='last lines of the log to include, plus one per aggregated job')
+parser.add_argument('--max-bytes', type=int, default=64 * 1024, metavar='BYTES',
+                    help='cap on the size of the log in the mail')
+
+def bounded(stream, head_lines:int, tail_lines:int, max_bytes:int) -> str:
+    '''the first and last lines of a log, within max_bytes,
+       however much the job wrote; only those are ever held in memory'''
+    head:list[bytes] = []
+    tail:collections.deque = collections.deque(maxlen=tail_lines)
+    # a share of the cap for each line, so that a single huge line doesn't evict the others
+    width = max(80, max_bytes // max(1, head_lines + tail_lines))
+    skipped = 0
+    while True:
+        line = stream.readline(width)
+        if not line:
+            break
+        if not line.endswith(b'\n'):
+            # overlong line, drop the rest of it
+            while True:
+                rest = stream.readline(65536)
+                if not rest or rest.endswith(b'\n'):
+                    break
+            line += b' [...]\n'
+        if len(head) < head_lines:
+            head.append(line)
+            continue
+        if len(tail) == tail.maxlen:
+            skipped += 1
+        tail.append(line)
+
+    size = sum(len(line) for line in head) + sum(len(line) for line in tail)
+    while size > max_bytes and (head or tail):
+        size -= len(tail.popleft() if tail else head.pop())
+        skipped += 1
+    if skipped:
+        head.append(b'[... %d lines skipped ...]\n' % skipped)
+    return b''.join(head + list(tail)).decode('utf8', 'replace')
+
+def main() -> None:
+    start = time.monotonic()
+    args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    for pgm in ('/usr/sbin/sendmail', '/usr/lib/sendmail'):
+        if os.path.exists(pgm):
+            break
+    else:
+        print("<3>can't send error mail for %s without a MTA" % args.unit)
+        exit(0)
+
+    show = subprocess.check_output(
+                         ['systemctl', 'show', args.unit, '--property=' + ','.join(PROPERTIES)],
+                         universal_newlines=True)
+    properties = dict.fromkeys(PROPERTIES, '')
+    for line in show.splitlines():
+        key, _, value = line.partition('=')
+        properties[key] = value
+
+    user = properties['User'] or 'root'
+
+    mailto = user
+    mailfrom = 'root'
+
+    job_env = properties['Environment']
+
+    if job_env:
+        for var in job_env.split(' '):
+            try:
+                key , value = var.split('=', 1)
+                if key == 'MAILTO':
+                    mailto = value
+                if key == 'MAILFROM':
+                    mailfrom = value
+            except ValueError:
+                pass
+
+    if not mailto:
+       logging.info('This cron job (%s) opted out of email, therefore quitting', args.unit)
+       exit(0)
+
+    # aggregated units run several crontab lines,
+    # the generator records them as X-CronJob= entries
+    jobs = []
+    fragment = properties['FragmentPath']
+    if fragment:
         try:
-            key , value = var.split('=', 1)
-            if key == 'MAILTO':
-                mailto = value
-            if key == 'MAILFROM':
-                mailfrom = value
-        except ValueError:
+            with open(fragment, 'r', encoding='utf8') as f:
+                for line in f:
+                    if line.startswith('X-CronJob='):
+                        jobs.append(line.rstrip('\n').split('=', 1)[1])
+        except OSError:
             pass
 
-if not mailto:
-   logging.info('This cron job (%s) opted out of email, therefore quitting', args.unit)
-   exit(0)
+    hostname = os.uname()[1]
+
+    def systemctl_status() -> str:
+        for locale in (None, 'C.UTF-8', 'C'):
+            if locale:
+                os.environ['LC_ALL'] = locale
+            try:
+                output = subprocess.check_output(['systemctl', 'status', '--lines=%d' % (args.tail + len(jobs)), args.unit],
+                                                 universal_newlines=True)
+                logging.warning('systemctl status should have failed')
+                return output
+            except UnicodeDecodeError:
+                logging.info('current locale (%s) is broken, try again', locale)
+            except subprocess.CalledProcessError as e:
+                if e.returncode != 3:
+                    raise
+                return e.output
+        return ''
+
+    def journal() -> str:
+        '''the logs of the run that failed, and only those'''
+        command = ['journalctl', '--no-pager', '--quiet', '--output=short',
+                   '_SYSTEMD_INVOCATION_ID=%s' % properties['InvocationID']]
+        if not args.head:
+            command.append('--lines=%d' % (args.tail + len(jobs)))
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as proc:
+            logs = bounded(proc.stdout, args.head, args.tail + len(jobs), args.max_bytes)
+        return ('%s - %s\n'
+                '   Result: %s, status=%s\n'
+                '\n%s' % (args.unit, properties['Description'],
+                          properties['Result'], properties['ExecMainStatus'],
+                          logs))
+
+    if properties['InvocationID']:
+        output = journal()
+    else:
+        # systemd < 232, the status of the unit then its log
+        header, _, logs = systemctl_status().partition('\n\n')
+        output = header + '\n\n' + bounded(io.BytesIO(logs.encode('utf8')),
+                                             args.head, args.tail + len(jobs), args.max_bytes)
+
+    if jobs:
+        failed = []
+        for match in re.finditer(r'systemd-cron: job (\d+) of \d+ failed with status (\d+)', output):
+            index = int(match.group(1)) - 1
+            if index < len(jobs):
+                failed.append('%s (status %s)' % (jobs[index], match.group(2)))
+        if failed:
+            output = 'Failed jobs:\n' + ''.join('  %s\n' % job for job in failed) + '\n' + output
+
+    subject = "[" + hostname + "] job " + args.unit + " failed"
+
+    def spool() -> None:
+        '''written atomically, mail_digest ignores the dot files'''
+        name = '%s.%s.json' % (args.unit, properties['InvocationID'] or int(time.time() * 1e6))
+        with open(os.path.join(SPOOL_DIR, '.' + name), 'w', encoding='utf8') as f:
+            json.dump({
+                'time': time.time(),
+                'unit': args.unit,
+                'mailto': mailto,
+                'mailfrom': mailfrom,
+                'subject': subject,
+                'body': output,
+            }, f)
+        os.rename(os.path.join(SPOOL_DIR, '.' + name), os.path.join(SPOOL_DIR, name))
 
-hostname = os.uname()[1]
+    def latency() -> str:
+        text = '%.3fs' % (time.monotonic() - start)
+        failed_at = properties['ExecMainExitTimestampMonotonic']
+        if failed_at.isdigit() and int(failed_at):
+            text += ', %.3fs after the failure' % (time.clock_gettime(time.CLOCK_MONOTONIC) - int(failed_at) / 1e6)
+        return text
 
-for locale in (None, 'C.UTF-8', 'C'):
-    if locale:
-        os.environ['LC_ALL'] = locale
+    if args.digest:
+        spool()
+        print('<6>failure of %s for %s spooled in %s' % (args.unit, mailto, latency()))
+        exit(0)
+
+    # Encode the message in 8-bit UTF-8
+    # Virtually all modern MTAs are 8-bit clean and send each other 8-bit data
+    # without checking each other's 8BITMIME flag.
+    message_object = email.message.Message()
+    message_object['Date'] = email.utils.formatdate()
+    message_object['From'] = mailfrom + ' (systemd-cron)'
+    message_object['To'] = mailto
+    message_object['Subject'] = subject
+    # https://datatracker.ietf.org/doc/html/rfc3834#section-5
+    message_object['Auto-Submitted'] = 'auto-generated'
+    message_object['MIME-Version'] = '1.0'
+    message_object['Content-Type'] = 'text/plain; charset="utf-8"'
+    message_object['Content-Transfer-Encoding'] = '8bit'
+
+    # only the headers are rendered by the email module,
+    # the body is streamed as it is
+    sendmail = subprocess.Popen(
+            ['sendmail',
+             '-i',
+             '-B8BITMIME',
+             mailto],
+            stdin=subprocess.PIPE)
     try:
-        output = subprocess.check_output(['systemctl', 'status', args.unit], universal_newlines=True)
-        logging.warning('systemctl status should have failed')
-        break
-    except UnicodeDecodeError:
-        logging.info('current locale (%s) is broken, try again', locale)
-    except subprocess.CalledProcessError as e:
-        if e.returncode != 3:
-            raise
-        else:
-            output = e.output
-            break
+        sendmail.stdin.write(message_object.as_bytes())
+        for line in output.splitlines(keepends=True):
+            sendmail.stdin.write(line.encode('utf8'))
+    except BrokenPipeError:
+        print('<3>sendmail exited before reading the mail about %s' % args.unit)
+    finally:
+        # the last write may still be buffered
+        try:
+            sendmail.stdin.close()
+        except BrokenPipeError:
+            pass
+    sendmail.wait()
+
+    print('<6>mail about %s to %s sent in %s' % (args.unit, mailto, latency()))
 
-# Encode the message in 8-bit UTF-8
-# Virtually all modern MTAs are 8-bit clean and send each other 8-bit data
-# without checking each other's 8BITMIME flag.
-utf8_8bit = email.charset.Charset('utf-8')
-utf8_8bit.body_encoding = None
-
-message_object = email.mime.text.MIMEText(_text=output, _charset=utf8_8bit)
-message_object['Date'] = email.utils.formatdate()
-message_object['From'] = mailfrom + ' (systemd-cron)'
-message_object['To'] = mailto
-message_object['Subject'] = "[" + hostname + "] job " + args.unit + " failed"
-# https://datatracker.ietf.org/doc/html/rfc3834#section-5
-message_object['Auto-Submitted'] = 'auto-generated'
-
-subprocess.run(
-        ['sendmail',
-         '-i',
-         '-B8BITMIME',
-         mailto],
-        universal_newlines=False,
-        input=message_object.as_bytes())
+if __name__ == '__main__':
+    main()
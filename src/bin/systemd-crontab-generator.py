@@ -1,37 +1,43 @@
 #!/usr/bin/python3
 import copy
 import errno
+import glob
 import hashlib
+import json
+import multiprocessing
 import os
-import pwd
-import re
-import stat
-import string
+import shutil
 import sys
-from functools import reduce
+import tempfile
+from functools import lru_cache
 from typing import Iterator, Optional
-from enum import IntEnum
 
-envvar_re = re.compile(r'^([A-Za-z_0-9]+)\s*=\s*(.*)$')
+sys.path.insert(0, '@libdir@/systemd-cron')
+import systemd_cron
+from systemd_cron import (CACHEDIR, HAS_SENDMAIL, KSH_SHELLS, PERSISTENT,
+                          REBOOT_FILE, SELF, SLICES_CONF, STABLE_NAMES, STATEDIR,
+                          Job, Log, file_version, log, parse_crontab,
+                          parse_crontab_cached, preload_passwd, prune_parsed,
+                          setting, stats)
+
+CRONTAB = '/etc/crontab'
+CRONTAB_DIR = '/etc/cron.d'
+PARTS_DIR = '/etc/cron.%s'
+ANACRONTAB = '/etc/anacrontab'
+# where native timers can shadow a cron job, the first one holds the distribution timers
+UNIT_DIRS = ['/lib/systemd/system', '/etc/systemd/system', '/run/systemd/system']
 
-MINUTES_SET = list(range(0, 60))
-HOURS_SET = list(range(0, 24))
-DAYS_SET = list(range(1, 32))
-DOWS_SET = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-MONTHS_SET = list(range(1, 13))
-
-KSH_SHELLS = ['/bin/sh', '/bin/dash', '/bin/ksh', '/bin/bash', '/usr/bin/zsh']
-REBOOT_FILE = '/run/crond.reboot'
-
-USE_LOGLEVELMAX = "@use_loglevelmax@"
-RANDOMIZED_DELAY = "@randomized_delay@" == "True"
 USE_RUNPARTS = "@use_runparts@" == "True"
-PERSISTENT = "@persistent@" == "True"
-LIBDIR = "@libdir@"
-STATEDIR = "@statedir@"
+MANIFEST = os.path.join(CACHEDIR, 'manifest.json')
+MANIFEST_VERSION = 3
+
+# minimal count of modified user crontabs needed to parse them in parallel
+PARALLEL_MIN = 32
+# ... and to load the whole passwd database at once
+PASSWD_BULK = 256
 
-SELF = os.path.basename(sys.argv[0])
-VALID_CHARS = "-_" + string.ascii_letters + string.digits
+# --dry-run: JSON Lines on stdout, nothing is written
+DRY_RUN = False
 
 # this is dumb, but gets the job done
 PART2TIMER = {
@@ -46,691 +52,603 @@ CROND2TIMER = {
     'sysstat': 'sysstat-collect',
 }
 
-for pgm in ('/usr/sbin/sendmail', '/usr/lib/sendmail'):
-    if os.path.exists(pgm):
-        HAS_SENDMAIL = True
-        break
-else:
-    HAS_SENDMAIL = False
-
-class Log(IntEnum):
-    EMERG = 0
-    ALERT = 1
-    CRIT = 2
-    ERR = 3
-    WARNING = 4
-    NOTICE = 5
-    INFO = 6
-    DEBUG = 7
-
-class Job:
-    '''Job definition'''
+class Source:
+    '''units generated from one crontab'''
     filename:str
-    basename:str
-    line:str
-    parts:list[str]
-    environment:dict[str, str]
-    shell:str
-    random_delay:int
-    # either period or timespec
-    period:str
-    timespec_minute:list[str] # 0-60
-    timespec_hour:list[str] # 0-24
-    timespec_dom:list[str] # 0-31
-    timespec_dow:list[str] # 0-7
-    timespec_month:list[str] # 0-12
-    sunday_is_seven:bool
-    schedule:str
-    boot_delay:int
-    start_hour:int
-    persistent:bool
-    batch:bool
-    jobid:str
-    unit_name:str
-    user:str
-    home:Optional[str]
-    command:list[str]
-    execstart:str
-    scriptlet:str
-    valid:bool
-    standardoutput:Optional[str]
-    testremoved:Optional[str]
-
-    def __init__(self, filename:str, line:str) -> None:
+    key:dict
+    mtime:int
+    size:int
+    digest:Optional[str]
+    units:dict[str, str]
+    linenos:dict[str, int]
+    delays:dict[str, int]
+    seqs:dict[str, int]
+    probes:dict[str, bool]
+    mailto:Optional[str]
+    shared:bool
+    pending:dict[tuple, list[Job]]
+
+    def __init__(self, filename:str, key:Optional[dict]=None) -> None:
         self.filename = filename
-        self.basename = os.path.basename(filename)
-        self.line = line
-        self.parts = line.split()
-        self.environment = dict()
-        self.shell = '/bin/sh'
-        self.boot_delay = 0
-        self.start_hour = 0
-        self.random_delay = 0
-        self.persistent = False
-        self.user = 'root'
-        self.home = None
-        self.command = []
-        self.valid = True
-        self.batch = False
-        self.standardoutput = None
-        self.testremoved = None
-        self.period = ''
-        self.timespec_minute = []
-        self.timespec_hour = []
-        self.timespec_dow = []
-        self.timespec_dom = []
-        self.timespec_month = []
-        self.sunday_is_seven = False
-        self.schedule = ''
-
-    def log(self, priority:int, message:str) -> None:
-        log(priority, '%s in %s:%s' % (message, self.filename, self.line))
-
-    def decode_environment(self, default_persistent:bool) -> None:
-        '''decode some environment variables that influence
-           the behaviour of systemd-cron itself'''
-
-        if 'SHELL' in self.environment:
-            self.shell = self.environment['SHELL']
-
-        if 'PERSISTENT' in self.environment:
-            self.persistent = self.environment['PERSISTENT'].lower() in ['yes', 'true', '1']
-            del self.environment['PERSISTENT']
-        else:
-            self.persistent = default_persistent
-
-        if 'MAILTO' in self.environment and self.environment['MAILTO']:
-            if not HAS_SENDMAIL:
-               self.log(Log.WARNING, 'a MTA is not installed, but MAILTO is set')
-
-        if 'RANDOM_DELAY' in self.environment:
-            try:
-                self.random_delay = int(self.environment['RANDOM_DELAY'])
-                del self.environment['RANDOM_DELAY']
-            except ValueError:
-                self.log(Log.WARNING, 'invalid RANDOM_DELAY')
-
-        if 'START_HOURS_RANGE' in self.environment:
-            try:
-                self.start_hour = int(self.environment['STARTS_HOURS_RANGE'])
-                del self.environment['STARTS_HOURS_RANGE']
-            except ValueError:
-                self.log(Log.WARNING, 'invalid START_HOURS_RANGE')
+        self.key = key or dict()
+        self.mtime = 0
+        self.size = 0
+        self.digest = None
+        self.units = dict()
+        self.linenos = dict()
+        self.delays = dict()
+        self.seqs = dict()
+        self.probes = dict()
+        self.mailto = None
+        self.shared = False
+        self.pending = dict()
+        stats.count('stat')
+        try:
+            statbuf = os.stat(filename)
+            self.mtime = statbuf.st_mtime_ns
+            self.size = statbuf.st_size
+        except OSError:
+            pass
 
-        if 'DELAY' in self.environment:
+    def hash(self) -> str:
+        if self.digest is None:
+            digest = hashlib.md5()
             try:
-                self.boot_delay = int(self.environment['DELAY'])
-                del self.environment['DELAY']
-            except ValueError:
-                self.log(Log.WARNING, 'invalid DELAY')
-
-        if 'BATCH' in self.environment:
-            self.batch = self.environment['BATCH'].lower() in ['yes','true','1']
-            del self.environment['BATCH']
-
-    def parse_anacrontab(self) -> None:
-        if len(self.parts) < 4:
-            self.valid = False
+                with open(self.filename, 'rb') as f:
+                    for chunk in iter(lambda: f.read(65536), b''):
+                        digest.update(chunk)
+            except OSError:
+                pass
+            self.digest = digest.hexdigest()
+        return self.digest
+
+    def add(self, name:str, content:str) -> None:
+        self.units[name] = content
+
+    def count(self, jobid:str) -> None:
+        '''a job of this crontab consumed a sequence number'''
+        if jobid not in self.seqs:
+            # the unit names also depends on the other crontabs
+            self.shared = self.shared or jobid in seqs
+            self.seqs[jobid] = 0
+        self.seqs[jobid] += 1
+
+    def dump(self) -> dict:
+        self.hash()
+        return {
+            'key': self.key,
+            'mtime': self.mtime,
+            'size': self.size,
+            'digest': self.digest,
+            'units': self.units,
+            'delays': self.delays,
+            'seqs': self.seqs,
+            'probes': self.probes,
+            'mailto': self.mailto,
+            'shared': self.shared,
+        }
+
+
+class Manifest:
+    '''source path -> mtime/size/hash -> emitted units
+
+       This is kept in CACHEDIR between runs, so that only
+       the crontabs that changed need to be parsed again.'''
+    previous:dict[str, dict]
+    sources:dict[str, Source]
+    context:dict
+
+    @stats.timed('manifest')
+    def __init__(self) -> None:
+        self.previous = dict()
+        self.sources = dict()
+        self.context = manifest_context()
+        if DRY_RUN:
             return
 
-        self.period, delay, jobid = self.parts[0:3]
-        self.jobid = 'anacron-' + jobid
         try:
-            self.boot_delay = int(delay)
-        except ValueError:
-            self.log(Log.WARNING, 'invalid DELAY')
-        self.command = self.parts[3:]
-
-    def parse_crontab_auto(self) -> None:
-        '''crontab --translate <something>'''
-        if self.line.startswith('@'):
-            self.parse_crontab_at(False)
-        else:
-            self.parse_crontab_timespec(False)
-
-        if self.command:
-            if len(self.command) > 1:
-                maybe_user = self.command[0]
-                try:
-                    pwd.getpwnam(maybe_user)
-                    self.user = maybe_user
-                    self.command = self.command[1:]
-                except:
-                    self.user = os.getlogin()
+            with open(MANIFEST, 'r', encoding='utf8') as f:
+                data = json.load(f)
+            if data['version'] == MANIFEST_VERSION and data['context'] == self.context:
+                self.previous = data['sources']
             else:
-                self.user = os.getlogin()
-
-            pgm = which(self.command[0])
-            if pgm:
-                self.command[0] = pgm
-            self.execstart = ' '.join(self.command)
-
-    def parse_crontab_at(self, withuser:bool) -> None:
-        '''@daily (user) do something'''
-        if len(self.parts) < (2 + int(withuser)):
-            self.valid = False
-            return
-
-        self.period = self.parts[0]
-        if withuser:
-            self.user = self.parts[1]
-            self.command = self.parts[2:]
-        else:
-            self.user = self.basename
-            self.command = self.parts[1:]
-        self.jobid = self.basename + '-' + self.user
-
-    def parse_crontab_timespec(self, withuser:bool) -> None:
-        '''6 2 * * * (user) do something'''
-        if len(self.parts) < (6 + int(withuser)):
-            self.valid = False
-            return
-
-        minutes, hours, days, months, dows = self.parts[0:5]
-        self.timespec_minute = self.parse_time_unit(minutes, MINUTES_SET)
-        self.timespec_hour = self.parse_time_unit(hours, HOURS_SET)
-        self.timespec_dom = self.parse_time_unit(days, DAYS_SET)
-        self.timespec_dow = self.parse_time_unit(dows, DOWS_SET, dow_map)
-        self.sunday_is_seven = dows.endswith('7') or dows.lower().endswith('sun')
-        self.timespec_month = self.parse_time_unit(months, MONTHS_SET, month_map)
-
-        if withuser:
-            self.user = self.parts[5]
-            self.command = self.parts[6:]
-        else:
-            self.user = self.basename
-            self.command = self.parts[5:]
-        self.jobid = self.basename + '-' + self.user
-
-    def parse_time_unit(self, value:str, values, mapping=int) -> list[str]:
-        result:list[str]
-        if value == '*':
-            return ['*']
-        try:
-            base = min(values)
-            # day of weeks
-            if isinstance(base, str):
-                base = 0
-            result = sorted(reduce(lambda a, i: a.union(set(i)), list(map(values.__getitem__,
-            list(map(parse_period(mapping, base), value.split(','))))), set()))
-        except ValueError:
-            result = []
-        if not len(result):
-            self.log(Log.ERR, 'garbled time')
-            self.valid = False
-        return result
-
-    def decode(self):
-        '''decode & validate'''
-        self.jobid = ''.join(c for c in self.jobid if c in VALID_CHARS)
-        self.decode_command()
-
-    def decode_command(self) -> None:
-        '''perform smart substitutions for known shells'''
-        if self.shell not in KSH_SHELLS:
-            return
-
-        try:
-            self.home = pwd.getpwnam(self.user).pw_dir
-        except KeyError:
+                log(Log.DEBUG, 'manifest is outdated, doing a full rebuild')
+        except OSError:
             pass
-        if self.home:
-            if self.command[0].startswith('~/'):
-                self.command[0] = self.home + self.command[0][2:]
-
-            if 'PATH' in self.environment:
-                parts = self.environment['PATH'].split(':')
-                for i, part in enumerate(parts):
-                    if part.startswith('~/'):
-                        parts[i] = self.home + part[1:]
-                self.environment['PATH'] = ':'.join(parts)
-
-
-        if (len(self.command) >= 3 and
-            self.command[-2] == '>' and
-            self.command[-1] == '/dev/null'):
-            self.command = self.command[0:-2]
-            self.standardoutput = '/dev/null'
-
-        if (len(self.command) >= 2 and
-            self.command[-1] == '>/dev/null'):
-            self.command = self.command[0:-1]
-            self.standardoutput = '/dev/null'
-
-        if (len(self.command) == 6 and
-            self.command[0] == '[' and
-            self.command[1] in ['-x','-f','-e'] and
-            self.command[2] == self.command[5] and
-            self.command[3] == ']' and
-            self.command[4] == '&&' ):
-                self.testremoved = self.command[2]
-                self.command = self.command[5:]
-
-        if (len(self.command) == 5 and
-            self.command[0] == 'test' and
-            self.command[1] in ['-x','-f','-e'] and
-            self.command[2] == self.command[4] and
-            self.command[3] == '&&' ):
-                self.testremoved = self.command[2]
-                self.command = self.command[4:]
-
-    def is_active(self) -> bool:
-        if self.testremoved and not os.path.isfile(self.testremoved):
-            log(Log.NOTICE, '%s is removed, skipping job' % self.testremoved)
-            return False
+        except (ValueError, KeyError, TypeError):
+            log(Log.NOTICE, 'manifest is corrupt, doing a full rebuild')
 
-        if self.schedule == 'reboot' and os.path.isfile(REBOOT_FILE):
-            return False
-
-        if (len(self.command) == 6 and
-            self.command[0] == '[' and
-            self.command[1] in ['-d','-e'] and
-            self.command[2].startswith('/run/systemd') and
-            self.command[3] == ']' and
-            self.command[4] == '||'):
-            return False
+    def lookup(self, source:Source) -> Optional[dict]:
+        '''find the units of an unchanged crontab'''
+        entry = self.previous.get(source.filename)
+        if not entry or entry['shared'] or entry['key'] != source.key:
+            return None
+        if entry['size'] != source.size:
+            return None
+        if entry['mtime'] != source.mtime and entry['digest'] != source.hash():
+            return None
+        for path, isfile in entry['probes'].items():
+            if os.path.isfile(path) != isfile:
+                return None
+        return entry
 
-        if (len(self.command) == 5 and
-            self.command[0] == 'test' and
-            self.command[1] in ['-d','-e'] and
-            self.command[2].startswith('/run/systemd') and
-            self.command[3] == '||'):
+    def replay(self, source:Source) -> bool:
+        '''reuse the units of an unchanged crontab'''
+        entry = self.lookup(source)
+        if entry is None or not claim(entry['seqs'], entry['units']):
             return False
 
+        source.digest = entry['digest']
+        source.units = entry['units']
+        source.delays = entry['delays']
+        source.seqs = entry['seqs']
+        source.probes = entry['probes']
+        source.mailto = entry['mailto']
         return True
 
-    def generate_schedule(self) -> None:
-        if self.period:
-             self.generate_schedule_from_period()
-        else:
-             self.generate_schedule_from_timespec()
-
-    def generate_schedule_from_period(self) -> None:
-        TIME_UNITS_SET = ['daily', 'weekly', 'monthly',
-                          'quarterly', 'semi-annually', 'yearly']
-        hour = self.start_hour
-
-        self.period = self.period.lower().lstrip('@')
-        self.period = {
-                'boot': 'reboot',
-                '1': 'daily',
-                '7': 'weekly',
-                '30': 'monthly',
-                '31': 'monthly',
-                'biannually': 'semi-annually',
-                'bi-annually': 'semi-annually',
-                'semiannually': 'semi-annually',
-                'anually': 'yearly',
-                'annually': 'yearly',
-                '365': 'yearly',
-        }.get(self.period, self.period)
-
-        if self.period == 'reboot':
-            self.boot_delay = max(self.boot_delay, 1)
-            self.schedule = self.period
-            self.persistent = False
-        elif self.period == 'minutely':
-            self.schedule = self.period
-            self.persistent = False
-        elif self.period == 'hourly' and self.boot_delay == 0:
-            self.schedule = 'hourly'
-        elif self.period == 'hourly':
-            self.schedule = '*-*-* *:%s:0' % self.boot_delay
-            self.boot_delay = 0
-        elif self.period == 'midnight' and self.boot_delay == 0:
-            self.schedule = 'daily'
-        elif self.period == 'midnight':
-            self.schedule = '*-*-* 0:%s:0' % self.boot_delay
-        elif self.period in TIME_UNITS_SET and hour == 0 and self.boot_delay == 0:
-            self.schedule = self.period
-        elif self.period == 'daily':
-            self.schedule = '*-*-* %s:%s:0' % (hour, self.boot_delay)
-        elif self.period == 'weekly':
-            self.schedule = 'Mon *-*-* %s:%s:0' % (hour, self.boot_delay)
-        elif self.period == 'monthly':
-            self.schedule = '*-*-1 %s:%s:0' % (hour, self.boot_delay)
-        elif self.period == 'quarterly':
-            self.schedule = '*-1,4,7,10-1 %s:%s:0' % (hour, self.boot_delay)
-        elif self.period == 'semi-annually':
-            self.schedule = '*-1,7-1 %s:%s:0' % (hour, self.boot_delay)
-        elif self.period == 'yearly':
-            self.schedule = '*-1-1 %s:%s:0' % (hour, self.boot_delay)
-        else:
-            try:
-               period = int(self.period)
-               assert type(period) is int
-               if period > 31:
-                    # workaround for anacrontab
-                    divisor = int(round(period / 30))
-                    self.schedule = '*-1/%s-1 %s:%s:0' % (divisor, hour, self.boot_delay)
-               else:
-                    self.schedule = '*-*-1/%s %s:%s:0' % (self.period, hour, self.boot_delay)
-            except ValueError:
-               self.log(Log.ERR, 'unknown schedule')
-               self.schedule = self.period
-
-    def generate_schedule_from_timespec(self) -> None:
-        if self.timespec_dow == ['*']:
-            dows = ''
-        else:
-            dows_sorted = []
-            for day in DOWS_SET[int(self.sunday_is_seven):]:
-                if day in self.timespec_dow and not day in dows_sorted:
-                    dows_sorted.append(day)
-            dows = ','.join(dows_sorted) + ' '
-
-        if '0' in self.timespec_month:
-            self.timespec_month.remove('0')
-        if '0' in self.timespec_dom:
-            self.timespec_dom.remove('0')
-
-        if (not len(self.timespec_month) or
-           not len(self.timespec_dom) or
-           not len(self.timespec_hour) or
-           not len(self.timespec_minute)):
-            self.valid = False
-            self.log(Log.ERR, 'unknown schedule')
-            return None
+    def commit(self, source:Source) -> None:
+        self.sources[source.filename] = source
 
-        self.schedule = '%s*-%s-%s %s:%s:00' % (
-                      dows,
-                      ','.join(map(str, self.timespec_month)),
-                      ','.join(map(str, self.timespec_dom)),
-                      ','.join(map(str, self.timespec_hour)),
-                      ','.join(map(str, self.timespec_minute))
-                   )
-
-    def generate_scriptlet(self) -> Optional[str]:
-        '''...only if needed'''
-        assert self.unit_name
-        if len(self.command) == 1:
-            if os.path.isfile(self.command[0]):
-                self.execstart = self.command[0]
-                return None
-            else:
-                pgm = which(self.command[0])
-                if pgm:
-                    self.execstart = pgm
-                    return None
-
-        self.scriptlet = os.path.join(TARGET_DIR, '%s.sh' % self.unit_name)
-        self.execstart = self.shell + ' ' + self.scriptlet
-        return ' '.join(self.command)
-
-    def generate_service(self) -> str:
-        lines = list()
-        lines.append('[Unit]')
-        lines.append('Description=[Cron] "%s"' % self.line.replace('%', '%%'))
-        lines.append('Documentation=man:systemd-crontab-generator(8)')
-        if self.filename != '-':
-            lines.append('SourcePath=%s' % self.filename)
-        if 'MAILTO' in self.environment and not self.environment['MAILTO']:
-            pass # mails explicitely disabled
-        elif not HAS_SENDMAIL:
-            pass # mails automaticaly disabled
-        else:
-            lines.append('OnFailure=cron-failure@%i.service')
-        if self.user != 'root' or STATEDIR in self.filename:
-            lines.append('Requires=systemd-user-sessions.service')
-            if self.home:
-                lines.append('RequiresMountsFor=%s' % self.home)
-        lines.append('')
-
-        lines.append('[Service]')
-        lines.append('Type=oneshot')
-        lines.append('IgnoreSIGPIPE=false')
-        lines.append('KillMode=process')
-        if USE_LOGLEVELMAX != 'no':
-            lines.append('LogLevelMax=%s' % USE_LOGLEVELMAX)
-        if self.schedule and self.boot_delay:
-            lines.append('ExecStartPre=-%s/systemd-cron/boot_delay %s' % (LIBDIR, self.boot_delay))
-        lines.append('ExecStart=%s' % self.execstart)
-        if self.environment:
-             lines.append('Environment=%s' % environment_string(self.environment))
-        lines.append('User=%s' % self.user)
-        if self.standardoutput:
-             lines.append('StandardOutput=%s' % self.standardoutput)
-        if self.batch:
-             lines.append('CPUSchedulingPolicy=idle')
-             lines.append('IOSchedulingClass=idle')
-
-        return '\n'.join(lines)
+    @stats.timed('manifest')
+    def save(self) -> None:
+        if DRY_RUN or not os.path.isdir(CACHEDIR):
+            return
+        data = {
+            'version': MANIFEST_VERSION,
+            'context': self.context,
+            'sources': {filename: source.dump() for filename, source in self.sources.items()},
+        }
+        try:
+            with open(MANIFEST + '.new', 'w', encoding='utf8') as f:
+                json.dump(data, f)
+            os.rename(MANIFEST + '.new', MANIFEST)
+        except OSError as e:
+            # read-only during early boot
+            log(Log.DEBUG, "can't save manifest: %s" % e)
+
+
+# spelled out, so that their minutes and seconds can be shifted
+CALENDAR_EXPANSIONS = {
+    'minutely': '*-*-* *:*:00',
+    'hourly': '*-*-* *:00:00',
+    'daily': '*-*-* 00:00:00',
+    'weekly': 'Mon *-*-* 00:00:00',
+    'monthly': '*-*-01 00:00:00',
+    'quarterly': '*-01,04,07,10-01 00:00:00',
+    'semi-annually': '*-01,07-01 00:00:00',
+    'yearly': '*-01-01 00:00:00',
+}
 
-    def generate_timer(self) -> str:
-        lines = list()
-        lines.append('[Unit]')
-        lines.append('Description=[Timer] "%s"' % self.line.replace('%', '%%'))
-        lines.append('Documentation=man:systemd-crontab-generator(8)')
-        lines.append('PartOf=cron.target')
-        if self.filename != '-':
-            lines.append('SourcePath=%s' % self.filename)
-        if self.testremoved:
-            lines.append('ConditionFileIsExecutable=%s' % self.testremoved)
-        lines.append('')
-
-        lines.append('[Timer]')
-        if self.schedule == 'reboot':
-            lines.append('OnBootSec=%sm' % self.boot_delay)
+def starts_in_hour(minute:str, second:str) -> Optional[list[int]]:
+    '''the seconds of the hour matched by the time of an OnCalendar='''
+    if not second.isdigit():
+        return None
+    minutes:set[int] = set()
+    for part in minute.split(','):
+        part, _, step = part.partition('/')
+        first, _, last = part.partition('..')
+        if first == '*':
+            first, last, step = '0', '59', step or '1'
+        if not first.isdigit() or not (last or first).isdigit() or not (step or '1').isdigit():
+            return None
+        stop = int(last) if last else (59 if step else int(first))
+        minutes.update(range(int(first), stop + 1, int(step or 1)))
+    return [m * 60 + int(second) for m in sorted(minutes)]
+
+class Stagger:
+    '''spread the timers that would all start at the same second, typically at the top of the hour
+
+       With systemd_cron.stagger=<minutes> on the kernel command line or
+       SYSTEMD_CRON_STAGGER=<minutes> in the environment, each timer is delayed
+       by up to that long; the offset is derived from its name, so it does not
+       change from a run to the next. A single minute is shifted as far as the
+       end of the hour, other schedules only get seconds. The timers that
+       already have a RANDOM_DELAY are left alone.'''
+    minutes:int
+    before:dict[int, int]
+    after:dict[int, int]
+
+    def __init__(self) -> None:
+        self.minutes = 0
+        self.before = dict()
+        self.after = dict()
+
+    def configure(self) -> None:
+        value = setting('stagger', '5')
+        if value is None:
+            return
+        try:
+            self.minutes = max(0, min(int(value or 5), 60))
+        except ValueError:
+            log(Log.WARNING, 'invalid stagger: %s' % value)
+
+    def shift(self, name:str, content:str) -> str:
+        '''the timer with its offset, also accounted for the report'''
+        lines = content.split('\n')
+        for i, line in enumerate(lines):
+            if line.startswith('OnCalendar='):
+                break
         else:
-            lines.append('OnCalendar=%s' % self.schedule)
-        if self.random_delay > 1:
-            if RANDOMIZED_DELAY:
-                lines.append('RandomizedDelaySec=%sm' % self.random_delay)
+            return content
+        if 'RandomizedDelaySec=' in content or 'AccuracySec=' in content:
+            return content
+        calendar = CALENDAR_EXPANSIONS.get(line[len('OnCalendar='):], line[len('OnCalendar='):])
+        date, _, time = calendar.rpartition(' ')
+        try:
+            hour, minute, second = time.split(':')
+        except ValueError:
+            return content
+        starts = starts_in_hour(minute, second)
+        if not starts:
+            return content
+        for start in starts:
+            self.before[start] = self.before.get(start, 0) + 1
+        offset = 0
+        if self.minutes:
+            digest = int(hashlib.md5(name.encode()).hexdigest()[:8], 16)
+            if minute.isdigit():
+                offset = digest % min(self.minutes * 60, 3600 - starts[0])
+                minute = str((starts[0] + offset) // 60)
             else:
-                lines.append('AccuracySec=%sm' % self.random_delay)
-        if self.persistent:
-            lines.append('Persistent=true')
-
+                offset = digest % min(self.minutes * 60, 60 - int(second))
+            time = '%s:%s:%02d' % (hour, minute, (starts[0] + offset) % 60)
+            lines[i] = 'OnCalendar=' + ' '.join(filter(None, [date, time]))
+            # the default of 1min would gather them again
+            lines.insert(i + 1, 'AccuracySec=1s')
+            stats.count('timers_staggered')
+        for start in starts:
+            self.after[start + offset] = self.after.get(start + offset, 0) + 1
         return '\n'.join(lines)
 
-    def generate_unit_name(self, seq) -> None:
-        assert self.jobid
-        if not self.persistent:
-            unit_id = next(seq)
-        else:
-            unit_id = hashlib.md5()
-            unit_id.update(bytes('\0'.join([self.schedule] + self.command), 'utf-8'))
-            unit_id = unit_id.hexdigest()
-        self.unit_name = "cron-%s-%s" % (self.jobid, unit_id)
+    @staticmethod
+    def peaks(histogram:dict[int, int]) -> tuple[int, int]:
+        '''most timers starting in the same second, and in the same minute'''
+        minutes:dict[int, int] = dict()
+        for start, n in histogram.items():
+            minutes[start // 60] = minutes.get(start // 60, 0) + n
+        return max(histogram.values(), default=0), max(minutes.values(), default=0)
+
+    def report(self) -> None:
+        before = self.peaks(self.before)
+        if not self.minutes:
+            log(Log.DEBUG, 'at most %d timers start in the same second, %d in the same minute' % before)
+            return
+        log(Log.INFO, 'stagger of %d minutes: at most %d timers start in the same second, '
+                      '%d in the same minute (%d and %d before)' %
+                      ((self.minutes,) + self.peaks(self.after) + before))
 
-    def output(self) -> None:
-        '''write the result in TARGET_DIR'''
-        assert self.unit_name
+stagger = Stagger()
 
-        code = self.generate_scriptlet() # as a side-effect also changes self.execstart
-        if code:
-            with open(self.scriptlet, 'w', encoding='utf8') as f:
-                f.write(code + '\n')
 
-        timer = os.path.join(TARGET_DIR, '%s.timer' % self.unit_name)
-        with open(timer, 'w', encoding='utf8') as f:
-            f.write(self.generate_timer() + '\n')
+class Output:
+    '''all the files generated during this run
 
-        try:
-            os.symlink(timer, os.path.join(TIMERS_DIR, '%s.timer' % self.unit_name))
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-               raise
+       They are first written in a staging folder, then moved in TARGET_DIR
+       once everything is ready; a generator killed in the middle of a run
+       leaves the previous units in place.'''
+    units:dict[str, str]
+    links:dict[str, str]
 
-        service = os.path.join(TARGET_DIR, '%s.service' % self.unit_name)
-        with open(service, 'w', encoding='utf8') as f:
-            f.write(self.generate_service() + '\n')
+    def __init__(self) -> None:
+        self.units = dict()
+        self.links = dict()
 
+    def add(self, source:Source) -> None:
+        for name, content in source.units.items():
+            if not name.endswith('.timer'):
+                self.add_unit(name, content)
+                continue
+            self.add_unit(name, stagger.shift(name, content))
+            delay = source.delays.get(name[:-len('.timer')])
+            if delay:
+                self.add_delay(delay)
+                self.add_link(os.path.join(TARGET_DIR, 'cron-delay-%d.target.wants' % delay), name)
+            else:
+                self.add_link(TIMERS_DIR, name)
 
+    def add_unit(self, name:str, content:str) -> None:
+        self.units[name] = content
 
-def which(exe):
-    '''TODO: we could use the PATH= variable from the crontab'''
-    for path in os.environ.get('PATH', '/usr/bin:/bin').split(os.pathsep):
+    def add_delay(self, delay:int) -> None:
+        '''a target reached some minutes after boot, that starts the delayed timers'''
+        if 'cron-delay-%d.target' % delay in self.units:
+            return
+        self.add_unit('cron-delay-%d.target' % delay,
+            '[Unit]\n'
+            'Description=systemd-cron jobs delayed %d minutes after boot\n'
+            'Documentation=man:systemd.cron(7)\n'
+            'PartOf=cron.target\n' % delay)
+        self.add_unit('cron-delay-%d.timer' % delay,
+            '[Unit]\n'
+            'Description=systemd-cron boot delay of %d minutes\n'
+            'Documentation=man:systemd.cron(7)\n'
+            'PartOf=cron.target\n'
+            '\n[Timer]\n'
+            'OnBootSec=%dm\n'
+            'Unit=cron-delay-%d.target\n' % (delay, delay, delay))
+        self.add_link(TIMERS_DIR, 'cron-delay-%d.timer' % delay)
+
+    def add_link(self, wants:str, name:str) -> None:
+        self.links[os.path.join(wants, name)] = os.path.join(TARGET_DIR, name)
+
+    @stats.timed('write')
+    def write(self) -> None:
+        for staging in glob.glob(os.path.join(TARGET_DIR, '.systemd-cron.*')):
+            # leftover of an interrupted run
+            shutil.rmtree(staging, ignore_errors=True)
+
+        staging = tempfile.mkdtemp(prefix='.systemd-cron.', dir=TARGET_DIR)
+        changed = []
+        unchanged = 0
         try:
-            abspath = os.path.join(path, exe)
-            statbuf = os.stat(abspath)
-        except:
-            continue
-        if stat.S_IMODE(statbuf.st_mode) & 0o111:
-            return abspath
-
-    return None
+            for name, content in self.units.items():
+                try:
+                    with open(os.path.join(TARGET_DIR, name), 'r', encoding='utf8') as f:
+                        if f.read() == content:
+                            unchanged += 1
+                            continue
+                except (OSError, UnicodeDecodeError):
+                    pass
+                with open(os.path.join(staging, name), 'w', encoding='utf8') as f:
+                    f.write(content)
+                changed.append(name)
+
+            # timers last, so they never refer to a missing service
+            changed.sort(key=lambda name: name.endswith('.timer'))
+            for name in changed:
+                os.rename(os.path.join(staging, name), os.path.join(TARGET_DIR, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        for link, target in self.links.items():
+            try:
+                os.makedirs(os.path.dirname(link), exist_ok=True)
+                os.symlink(target, link)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                   raise
+
+        removed = 0
+        for folder in [TARGET_DIR,
+                       TIMERS_DIR,
+                       os.path.join(TARGET_DIR, 'multi-user.target.wants')] + \
+                      glob.glob(os.path.join(TARGET_DIR, 'cron-delay-*.target.wants')):
+            for name in files_and_links(folder):
+                path = os.path.join(folder, name)
+                if not name.startswith('cron-') or path in self.links:
+                    continue
+                if folder == TARGET_DIR and (name in self.units or
+                                            not name.endswith(('.timer', '.service', '.sh', '.target', '.slice'))):
+                    continue
+                os.unlink(path)
+                removed += 1
+
+        stats.count('units_written', len(changed))
+        stats.count('units_unchanged', unchanged)
+        stats.count('units_removed', removed)
+        log(Log.INFO, '%d files written, %d unchanged, %d removed' % (len(changed), unchanged, removed))
+        stagger.report()
+
+
+class DryRun(Output):
+    '''one JSON object per unit on stdout, as soon as its crontab is done'''
+    def add(self, source:Source) -> None:
+        units = {name: stagger.shift(name, content) if name.endswith('.timer') else content
+                 for name, content in source.units.items()}
+        self.emit(units, source.filename, source.linenos, source.delays)
+
+    def emit(self, units:dict[str, str], filename:Optional[str]=None,
+             linenos:Optional[dict[str, int]]=None,
+             delays:Optional[dict[str, int]]=None) -> None:
+        linenos = linenos or dict()
+        delays = delays or dict()
+        # the slices are shared by the jobs of a user, and shown with each of them
+        for unit_name in dict.fromkeys(name.rsplit('.', 1)[0] for name in units
+                                       if not name.endswith('.slice')):
+            slice_unit = None
+            for line in units.get(unit_name + '.service', '').split('\n'):
+                if line.startswith('Slice='):
+                    slice_unit = units.get(line[len('Slice='):])
+            origin = None
+            if filename:
+                origin = filename
+                if linenos.get(unit_name):
+                    origin += ':%d' % linenos[unit_name]
+            json.dump({
+                'unit': unit_name,
+                'source': origin,
+                'timer': units.get(unit_name + '.timer'),
+                'service': units.get(unit_name + '.service'),
+                'scriptlet': units.get(unit_name + '.sh'),
+                'boot_delay': delays.get(unit_name),
+                'slice': slice_unit,
+            }, sys.stdout)
+            sys.stdout.write('\n')
+
+    @stats.timed('write')
+    def write(self) -> None:
+        self.emit(self.units)
+        sys.stdout.flush()
+        stagger.report()
+
+
+def manifest_context() -> dict:
+    '''everything besides the crontabs themselves that has an influence on the output'''
+    return {
+        'path': os.environ.get('PATH'),
+        'sendmail': HAS_SENDMAIL,
+        'target': TARGET_DIR,
+        'generator': file_version(__file__),
+        'library': file_version(systemd_cron.__file__),
+        'passwd': file_version('/etc/passwd'),
+        'slices': file_version(SLICES_CONF),
+    }
 
 def files(dirname:str) -> list[str]:
     try:
-        return list(filter(os.path.isfile, [os.path.join(dirname, f) for f in os.listdir(dirname)]))
+        result = list(filter(os.path.isfile, [os.path.join(dirname, f) for f in os.listdir(dirname)]))
     except OSError:
         return []
+    stats.count('files_scanned', len(result))
+    return result
 
-def environment_string(env:dict[str, str]) -> str:
-    line = []
-    for k, v in env.items():
-        if ' ' in v:
-            line.append('"%s=%s"' % (k, v))
-        else:
-            line.append('%s=%s' % (k, v))
-    return ' '.join(line)
-
-def parse_crontab(filename:str,
-                  withuser:bool=True,
-                  monotonic:bool=False) -> Iterator[Job]:
-    '''parser shared with /usr/bin/crontab'''
-
-    environment:dict[str,str] = dict()
-    with open(filename, 'rb') as f:
-        for rawline in f.readlines():
-            rawline = rawline.strip()
-            if not rawline or rawline.startswith(b'#'):
-                continue
-
-            try:
-                line = rawline.decode('utf8')
-            except UnicodeDecodeError:
-                # let's hope it's in a trailing comment
-                try:
-                    line = rawline.split(b'#')[0].decode('utf8')
-                except UnicodeDecodeError:
-                    line = rawline.decode('ascii', 'replace')
-
-            while '  ' in line:
-                line = line.replace('  ', ' ')
-
-            envvar = envvar_re.match(line)
-            if envvar:
-                key = envvar.group(1)
-                value = envvar.group(2)
-                value = value.strip("'").strip('"').strip(' ')
-                environment[key] = value
-                continue
-
-            j = Job(filename, line)
-            j.environment = copy.deepcopy(environment)
-            if monotonic:
-                j.decode_environment(default_persistent=True)
-                j.parse_anacrontab()
-            elif line.startswith('@'):
-                j.decode_environment(default_persistent=True)
-                j.parse_crontab_at(withuser)
-            else:
-                j.decode_environment(default_persistent=False)
-                j.parse_crontab_timespec(withuser)
-            j.decode()
-            j.generate_schedule()
-            yield j
-
-
-def month_map(month:str) -> int:
+def files_and_links(dirname:str) -> list[str]:
     try:
-        return int(month)
-    except ValueError:
-        return ['jan', 'feb', 'mar', 'apr',
-                'may', 'jun', 'jul', 'aug',
-                'sep', 'oct', 'nov', 'dec'].index(month.lower()[0:3]) + 1
-
-def dow_map(dow:str) -> int:
-    try:
-        return ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'].index(dow[0:3].lower())
-    except ValueError:
-        return int(dow) #% 7
-
-def parse_period(mapping=int, base=0):
-    def parser(value:str):
-        try:
-            range, step = value.split('/')
-        except ValueError:
-            range = value
-            step = '1'
-
-        if range == '*':
-            return slice(None, None, int(step))
-
-        try:
-            start, end = range.split('-')
-        except ValueError:
-            start = end = range
-
-        return slice(mapping(start) - 1 + int(not(bool(base))), mapping(end) + int(not(bool(base))), int(step))
-
-    return parser
+        return [entry.name for entry in os.scandir(dirname)
+                if entry.is_symlink() or entry.is_file(follow_symlinks=False)]
+    except OSError:
+        return []
 
-seqs:dict[str, int] = {}
-def count():
-    n = 0
+seqs:dict[str, Iterator[int]] = {}
+# the unit names taken so far, by all the crontabs
+names:set[str] = set()
+def count(n:int=0):
     while True:
         yield n
         n += 1
 
-def generate_timer_unit(job:Job):
+def claim(used:dict[str, int], units:dict[str, str]) -> bool:
+    '''continue the sequences of a crontab that was parsed separately,
+       only possible if its jobids and unit names were not already used'''
+    taken = [name[:-len('.timer')] for name in units if name.endswith('.timer')]
+    if any(jobid in seqs for jobid in used) or any(name in names for name in taken):
+        return False
+    for jobid, n in used.items():
+        seqs[jobid] = count(n)
+    names.update(taken)
+    return True
+
+def parse_user_crontab(filename:str) -> tuple[Source, dict]:
+    '''parse an user crontab on its own in a worker process'''
+    seqs.clear()
+    names.clear()
+    stats.clear()
+    source = Source(filename)
+    source.hash()
+    for job in parse_crontab_cached(filename):
+        generate_timer_unit(job, source)
+    generate_group_units(source)
+    return source, stats.dump()
+
+@stats.timed('workers')
+def parse_user_crontabs(manifest:Manifest, filenames:list[str]) -> dict[str, Source]:
+    '''parse the modified user crontabs with a pool of workers'''
+    filenames = [filename for filename in filenames
+                 if manifest.lookup(Source(filename)) is None]
+    if len(filenames) >= PASSWD_BULK:
+        preload_passwd()
+    workers = os.cpu_count() or 1
+    if len(filenames) < PARALLEL_MIN or workers == 1:
+        return dict()
+
+    # the workers need the globals set in __main__
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        chunksize = len(filenames) // (workers * 4) + 1
+        results = pool.map(parse_user_crontab, filenames, chunksize)
+    for _, figures in results:
+        stats.merge(figures)
+    return dict(zip(filenames, [source for source, _ in results]))
+
+def generate_timer_unit(job:Job, source:Source) -> None:
     if job.valid and job.is_active():
-        job.generate_unit_name(seqs.setdefault(job.jobid, count()))
-        job.output()
-
-def log(level:int, message:str) -> None:
-    if len(sys.argv) == 4:
-        with open('/dev/kmsg', 'w', encoding='utf8') as kmsg:
-            kmsg.write('<%s>%s[%s]: %s\n' % (level, SELF, os.getpid(), message))
-    else:
-        sys.stderr.write('%s: %s\n' % (SELF, message))
-
-def workaround_var_not_mounted():
+        if job.aggregate and job.shell in KSH_SHELLS:
+            source.pending.setdefault(job.group_key(), []).append(job)
+        else:
+            output_timer_unit(job, source)
+    source.probes.update(job.probes)
+
+def output_timer_unit(job:Job, source:Source) -> None:
+    if not job.persistent and not STABLE_NAMES:
+        source.count(job.jobid)
+    job.generate_unit_name(seqs.setdefault(job.jobid, count()))
+    deduplicate_unit_name(job, source)
+    job.output(source)
+    # generate_scriptlet() looks for the program
+    source.probes.update(job.probes)
+    source.linenos[job.unit_name] = job.lineno
+
+def deduplicate_unit_name(job:Job, source:Source) -> None:
+    '''the units named after a hash need a suffix when the same command
+       comes back in the same crontab, or in another one with the same jobid'''
+    unit_name = job.unit_name
+    n = 0
+    while job.unit_name in names:
+        if '%s.timer' % job.unit_name not in source.units:
+            # the unit names also depends on the other crontabs
+            source.shared = True
+        n += 1
+        job.unit_name = '%s-%d' % (unit_name, n)
+    names.add(job.unit_name)
+
+def generate_group_units(source:Source) -> None:
+    '''one timer & service for all the aggregated jobs
+       of a crontab that share the same user and schedule'''
+    for jobs in source.pending.values():
+        if len(jobs) == 1:
+            output_timer_unit(jobs[0], source)
+            continue
+        group = copy.copy(jobs[0])
+        group.group = jobs
+        group.line = '%s (and %d other jobs)' % (jobs[0].line, len(jobs) - 1)
+        unit_id = hashlib.md5()
+        for job in jobs:
+            unit_id.update(bytes('\0'.join([job.schedule] + job.command) + '\n', 'utf-8'))
+        group.unit_name = 'cron-%s-group-%s' % (group.jobid, unit_id.hexdigest())
+        deduplicate_unit_name(group, source)
+        group.output(source)
+        source.probes.update(group.probes)
+        source.linenos[group.unit_name] = group.lineno
+    source.pending.clear()
+
+def workaround_var_not_mounted(output:Output) -> None:
     '''schedule rerun of generators after /var is mounted'''
-    with open('%s/cron-after-var.service' % TARGET_DIR, 'w') as f:
-        f.write('[Unit]\n')
-        f.write('Description=Rerun systemd-crontab-generator because /var is a separate mount\n')
-        f.write('Documentation=man:systemd.cron(7)\n')
-        f.write('After=cron.target\n')
-        f.write('ConditionDirectoryNotEmpty=%s\n' % STATEDIR)
-        f.write('\n[Service]\n')
-        f.write('Type=oneshot\n')
-        f.write('ExecStart=/bin/sh -c "systemctl daemon-reload ; systemctl try-restart cron.target"\n')
-
-    MULTIUSER_DIR = os.path.join(TARGET_DIR, 'multi-user.target.wants')
-
-    try:
-       os.makedirs(MULTIUSER_DIR)
-    except OSError as e:
-       if e.errno != errno.EEXIST:
-           raise
-
-    try:
-        os.symlink('%s/cron-after-var.service' % TARGET_DIR, '%s/cron-after-var.service' % MULTIUSER_DIR)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    output.add_unit('cron-after-var.service',
+        '[Unit]\n'
+        'Description=Rerun systemd-crontab-generator because /var is a separate mount\n'
+        'Documentation=man:systemd.cron(7)\n'
+        'After=cron.target\n'
+        'ConditionDirectoryNotEmpty=%s\n'
+        '\n[Service]\n'
+        'Type=oneshot\n'
+        'ExecStart=/bin/sh -c "systemctl daemon-reload ; systemctl try-restart cron.target"\n' % STATEDIR)
+    output.add_link(os.path.join(TARGET_DIR, 'multi-user.target.wants'), 'cron-after-var.service')
+
+@lru_cache(maxsize=None)
+def timer_index() -> dict[str, list[str]]:
+    '''name.timer -> paths in UNIT_DIRS, each folder is only listed once'''
+    index:dict[str, list[str]] = dict()
+    for unitdir in UNIT_DIRS:
+        stats.count('listdir')
+        try:
+            names = os.listdir(unitdir)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith('.timer'):
+                index.setdefault(name, []).append(os.path.join(unitdir, name))
+    return index
 
+@stats.timed('is_masked')
 def is_masked(name:str, distro_mapping:dict[str,str]) -> bool:
     '''check if distribution also provide a native .timer'''
-    for unit_file in ('/lib/systemd/system/%s.timer' % name,
-                      '/etc/systemd/system/%s.timer' % name,
-                      '/run/systemd/system/%s.timer' % name):
-        if os.path.exists(unit_file):
-            if os.path.realpath(unit_file) == '/dev/null':
-                # TODO: check 0-byte file
-                reason = 'it is masked'
-            else:
-                reason = 'native timer is present'
-            log(Log.NOTICE, 'ignoring %s because %s' % (name, reason))
-            return True
+    for unit_file in timer_index().get('%s.timer' % name, []):
+        stats.count('stat')
+        if not os.path.exists(unit_file):
+            # dangling symlink
+            continue
+        if os.path.realpath(unit_file) == '/dev/null' or os.path.getsize(unit_file) == 0:
+            reason = 'it is masked'
+        else:
+            reason = 'native timer is present'
+        log(Log.NOTICE, 'ignoring %s because %s' % (name, reason))
+        return True
 
     name_distro = '%s.timer' % distro_mapping.get(name, name)
-    if os.path.exists('/lib/systemd/system/%s' % name_distro):
-        log(Log.NOTICE, 'ignoring %s because there is %s' % (name, name_distro))
-        return True
+    for unit_file in timer_index().get(name_distro, []):
+        stats.count('stat')
+        if os.path.dirname(unit_file) == UNIT_DIRS[0] and os.path.exists(unit_file):
+            log(Log.NOTICE, 'ignoring %s because there is %s' % (name, name_distro))
+            return True
 
     return False
 
@@ -744,28 +662,37 @@ def is_backup(name:str) -> bool:
     return False
 
 def main() -> None:
-    try:
-        os.makedirs(TIMERS_DIR)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    if not DRY_RUN:
+        try:
+            os.makedirs(TIMERS_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
+    manifest = Manifest()
+    output = DryRun() if DRY_RUN else Output()
     fallback_mailto = None
 
-    if os.path.isfile('/etc/crontab'):
-        for job in parse_crontab('/etc/crontab', withuser=True):
-            fallback_mailto = job.environment.get('MAILTO')
-            if not job.valid:
-                 log(Log.ERR, 'truncated line in /etc/crontab: %s' % job.line)
-                 continue
-            # legacy boilerplate
-            if '/etc/cron.hourly'  in job.line: continue
-            if '/etc/cron.daily'   in job.line: continue
-            if '/etc/cron.weekly'  in job.line: continue
-            if '/etc/cron.monthly' in job.line: continue
-            generate_timer_unit(job)
-
-    CRONTAB_FILES = files('/etc/cron.d')
+    if os.path.isfile(CRONTAB):
+        source = Source(CRONTAB)
+        if not manifest.replay(source):
+            for job in parse_crontab(CRONTAB, withuser=True):
+                source.mailto = job.environment.get('MAILTO')
+                if not job.valid:
+                     log(Log.ERR, 'truncated line in %s: %s' % (CRONTAB, job.line))
+                     continue
+                # legacy boilerplate
+                if '/etc/cron.hourly'  in job.line: continue
+                if '/etc/cron.daily'   in job.line: continue
+                if '/etc/cron.weekly'  in job.line: continue
+                if '/etc/cron.monthly' in job.line: continue
+                generate_timer_unit(job, source)
+            generate_group_units(source)
+        fallback_mailto = source.mailto
+        manifest.commit(source)
+        output.add(source)
+
+    CRONTAB_FILES = files(CRONTAB_DIR)
     for filename in CRONTAB_FILES:
         basename = os.path.basename(filename)
         if is_masked(basename, CROND2TIMER):
@@ -773,22 +700,27 @@ def main() -> None:
         if is_backup(basename):
             log(Log.DEBUG, 'ignoring %s' % basename)
             continue
-        for job in parse_crontab(filename, withuser=True):
-            if not job.valid:
-                log(Log.ERR, 'truncated line in %s: %s' % (filename, job.line))
-                continue
-            if fallback_mailto and 'MAILTO' not in job.environment:
-                job.environment['MAILTO'] = fallback_mailto
-            generate_timer_unit(job)
+        source = Source(filename, {'mailto': fallback_mailto})
+        if not manifest.replay(source):
+            for job in parse_crontab(filename, withuser=True):
+                if not job.valid:
+                    log(Log.ERR, 'truncated line in %s: %s' % (filename, job.line))
+                    continue
+                if fallback_mailto and 'MAILTO' not in job.environment:
+                    job.fork_environment()['MAILTO'] = fallback_mailto
+                generate_timer_unit(job, source)
+            generate_group_units(source)
+        manifest.commit(source)
+        output.add(source)
 
     if not USE_RUNPARTS:
         i = 0
         for period in ['hourly', 'daily', 'weekly', 'monthly', 'yearly']:
             i = i + 1
-            directory = '/etc/cron.' + period
+            directory = PARTS_DIR % period
             if not os.path.isdir(directory):
                 continue
-            CRONTAB_FILES = files('/etc/cron.' + period)
+            CRONTAB_FILES = files(directory)
             for filename in CRONTAB_FILES:
                 basename = os.path.basename(filename)
                 if is_masked(basename, PART2TIMER):
@@ -806,46 +738,102 @@ def main() -> None:
                 job.decode() # ensure clean jobid
                 job.generate_schedule()
                 if fallback_mailto and 'MAILTO' not in job.environment:
-                    job.environment['MAILTO'] = fallback_mailto
+                    job.fork_environment()['MAILTO'] = fallback_mailto
                 job.unit_name = 'cron-' + job.jobid
-                job.output()
-
-    if os.path.isfile('/etc/anacrontab'):
-        for job in parse_crontab('/etc/anacrontab', monotonic=True):
-            if not job.valid:
-                 log(Log.ERR, 'truncated line in /etc/anacrontab: %s' % job.line)
-                 continue
-            generate_timer_unit(job)
+                source = Source(filename)
+                job.output(source)
+                output.add(source)
+
+    if os.path.isfile(ANACRONTAB):
+        source = Source(ANACRONTAB)
+        if not manifest.replay(source):
+            for job in parse_crontab(ANACRONTAB, monotonic=True):
+                if not job.valid:
+                     log(Log.ERR, 'truncated line in %s: %s' % (ANACRONTAB, job.line))
+                     continue
+                generate_timer_unit(job, source)
+            generate_group_units(source)
+        manifest.commit(source)
+        output.add(source)
 
     if os.path.isdir(STATEDIR):
         # /var is avaible
-        USERCRONTAB_FILES = files(STATEDIR)
+        USERCRONTAB_FILES = [filename for filename in files(STATEDIR)
+                             if '.' not in os.path.basename(filename)]
+        parsed = parse_user_crontabs(manifest, USERCRONTAB_FILES)
         for filename in USERCRONTAB_FILES:
-            basename = os.path.basename(filename)
-            if '.' in basename:
-                continue
-            for job in parse_crontab(filename, withuser=False):
-                generate_timer_unit(job)
+            source = Source(filename)
+            if manifest.replay(source):
+                pass
+            elif filename in parsed and claim(parsed[filename].seqs, parsed[filename].units):
+                source = parsed[filename]
+            else:
+                for job in parse_crontab_cached(filename):
+                    generate_timer_unit(job, source)
+                generate_group_units(source)
+            manifest.commit(source)
+            output.add(source)
+        output.write()
+        manifest.save()
+        prune_parsed()
         try:
-            open(REBOOT_FILE,'a').close()
+            if not DRY_RUN:
+                open(REBOOT_FILE,'a').close()
         except:
             pass
     else:
-        workaround_var_not_mounted()
+        workaround_var_not_mounted(output)
+        output.write()
+
+
+def dry_run_arguments():
+    import argparse
+    parser = argparse.ArgumentParser(prog=SELF,
+        description='print the units that would be generated as JSON Lines, without writing anything')
+    parser.add_argument('--dry-run', action='store_true', required=True)
+    parser.add_argument('--root', default='/', metavar='DIR',
+                        help='read /etc/crontab, /etc/cron.d... below this folder')
+    parser.add_argument('--statedir', metavar='DIR',
+                        help='user crontabs, by default %s below the root' % STATEDIR)
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 1 or (os.path.exists(sys.argv[1])
+    if sys.argv[1:2] == ['--dry-run']:
+        args = dry_run_arguments()
+        DRY_RUN = True
+        systemd_cron.KMSG = False
+        systemd_cron.PARSED_DIR = ''
+
+        def rebase(path:str) -> str:
+            return os.path.join(args.root, path.lstrip('/'))
+        CRONTAB = rebase(CRONTAB)
+        CRONTAB_DIR = rebase(CRONTAB_DIR)
+        PARTS_DIR = rebase(PARTS_DIR)
+        ANACRONTAB = rebase(ANACRONTAB)
+        UNIT_DIRS = [rebase(unitdir) for unitdir in UNIT_DIRS]
+        systemd_cron.SLICES_CONF = rebase(SLICES_CONF)
+        STATEDIR = systemd_cron.STATEDIR = args.statedir or rebase(STATEDIR)
+        REBOOT_FILE = systemd_cron.REBOOT_FILE = rebase(REBOOT_FILE)
+        TARGET_DIR = systemd_cron.TARGET_DIR
+    elif len(sys.argv) == 1 or (os.path.exists(sys.argv[1])
                       and not os.path.isdir(sys.argv[1])):
         sys.exit("Usage: %s <destination_folder>" % sys.argv[0])
-
-    TARGET_DIR = sys.argv[1]
+    else:
+        TARGET_DIR = systemd_cron.TARGET_DIR = sys.argv[1]
     TIMERS_DIR = os.path.join(TARGET_DIR, 'cron.target.wants')
 
+    stats.configure()
+    stagger.configure()
+    if DRY_RUN:
+        # stdout is already taken
+        stats.report = False
     try:
-        main()
+        with stats.phase('total'):
+            main()
+        stats.write()
     except Exception as e:
-        if len(sys.argv) == 4:
+        if systemd_cron.KMSG:
             with open('/dev/kmsg', 'w') as fd:
                 fd.write('<%s> %s[%s]: global exception: %s\n' % (Log.CRIT, SELF, os.getpid(), e))
             exit(1)
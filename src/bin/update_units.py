@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+import argparse
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import struct
+import subprocess
+import time
+from typing import Optional
+
+__DOC__ = """ rerun the generator, then only touch the timers that changed """
+
+TARGET_DIR = '/run/systemd/generator'
+TIMERS_DIR = os.path.join(TARGET_DIR, 'cron.target.wants')
+# same as cron-update.path
+WATCHED = ['/etc/crontab', '/etc/cron.d', '/etc/anacrontab', '@statedir@']
+
+# <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+           IN_CREATE | IN_DELETE)
+EVENT = struct.Struct('iIII')
+
+parser = argparse.ArgumentParser(description=__DOC__)
+parser.add_argument('--debounce', type=float, default=3, metavar='SECONDS',
+                    help='wait until the crontabs were left alone that long')
+parser.add_argument('--max-wait', type=float, default=60, metavar='SECONDS',
+                    help='but never wait longer than that')
+parser.add_argument('--dry-run', action='store_true',
+                    help="show what would be done, don't reload")
+
+class Inotify:
+    '''changes of the watched crontabs, as reported by the kernel'''
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.events = 0
+        self.changed:set[str] = set()
+        self.folders:dict[int, str] = dict()
+        # single files are replaced by editors, so their folder is watched
+        self.names:dict[str, set] = dict()
+        for path in WATCHED:
+            if os.path.isdir(path):
+                self.add_watch(path, None)
+            else:
+                self.add_watch(os.path.dirname(path), os.path.basename(path))
+
+    def add_watch(self, folder:str, name:Optional[str]) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_MASK)
+        if wd < 0:
+            return
+        self.folders[wd] = folder
+        self.names.setdefault(folder, set()).add(name)
+
+    def wait(self, timeout:float) -> bool:
+        '''True if a crontab was touched before the timeout'''
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = max(0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return False
+            if self.read():
+                return True
+            if not remaining:
+                return False
+
+    def read(self) -> bool:
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        relevant = False
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = EVENT.unpack_from(buf, offset)
+            offset += EVENT.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.events += 1
+                relevant = True
+                continue
+            folder = self.folders.get(wd)
+            if folder is None:
+                continue
+            names = self.names[folder]
+            if None in names or name in names:
+                self.events += 1
+                self.changed.add(os.path.join(folder, name))
+                relevant = True
+        return relevant
+
+class Polling:
+    '''same, by comparing modification times, when inotify is not available'''
+    def __init__(self) -> None:
+        self.events = 0
+        self.changed:set[str] = set()
+        self.last = self.fingerprint()
+
+    @staticmethod
+    def fingerprint() -> dict[str, tuple]:
+        stamps = dict()
+        for path in WATCHED:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isdir(path):
+                stamps[path] = (st.st_mtime_ns, st.st_size)
+                continue
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    stamps[entry.path] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def wait(self, timeout:float) -> bool:
+        time.sleep(timeout)
+        current = self.fingerprint()
+        touched = {path for path in set(current) | set(self.last)
+                   if current.get(path) != self.last.get(path)}
+        self.last = current
+        self.events += len(touched)
+        self.changed |= touched
+        return bool(touched)
+
+def settle(watcher, debounce:float, max_wait:float) -> None:
+    '''coalesce a burst of edits, e.g. from configuration management'''
+    deadline = time.monotonic() + max_wait
+    while time.monotonic() < deadline:
+        if not watcher.wait(min(debounce, max(0, deadline - time.monotonic()))):
+            break
+
+def snapshot() -> dict[str, bytes]:
+    '''the timers pulled by cron.target, directly or
+       after a boot delay, and their content'''
+    timers = dict()
+    for folder in [TIMERS_DIR] + glob.glob(os.path.join(TARGET_DIR, 'cron-delay-*.target.wants')):
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            if not name.endswith('.timer'):
+                continue
+            try:
+                with open(os.path.join(folder, name), 'rb') as f:
+                    timers[name] = f.read()
+            except OSError:
+                # dangling link, lost to a concurrent run of the generator
+                pass
+    return timers
+
+def diff(before:dict[str, bytes], after:dict[str, bytes]) -> tuple[list[str], list[str], list[str]]:
+    '''the timers that are gone, new, and modified'''
+    stopped = sorted(set(before) - set(after))
+    started = sorted(set(after) - set(before))
+    changed = sorted(name for name in set(before) & set(after) if before[name] != after[name])
+    return stopped, started, changed
+
+def cron_active() -> bool:
+    return subprocess.call(['systemctl', '--quiet', 'is-active', 'cron.target']) == 0
+
+def systemctl(verb:str, units:list[str], dry_run:bool) -> None:
+    if not units:
+        return
+    if dry_run:
+        print('systemctl %s %s' % (verb, ' '.join(units)))
+        return
+    subprocess.call(['systemctl', verb, '--'] + units)
+
+def update(before:dict[str, bytes], after:dict[str, bytes], dry_run:bool) -> tuple[list[str], list[str], list[str]]:
+    '''the timers actually stopped, started and restarted'''
+    stopped, started, changed = diff(before, after)
+    # the services and scriptlets are picked up by the next run of their timer,
+    # only new schedules need a restart; and nothing is started while cron is stopped
+    systemctl('stop', stopped, dry_run)
+    if cron_active():
+        systemctl('restart', changed, dry_run)
+        systemctl('start', started, dry_run)
+    else:
+        started = changed = []
+    return stopped, started, changed
+
+def main() -> None:
+    start = time.monotonic()
+    args = parser.parse_args()
+    try:
+        watcher = Inotify()
+    except (OSError, AttributeError):
+        watcher = Polling()
+
+    before = snapshot()
+    reloads = 0
+    while True:
+        settle(watcher, args.debounce, args.max_wait)
+        if args.dry_run:
+            print('systemctl daemon-reload')
+        else:
+            subprocess.check_call(['systemctl', 'daemon-reload'])
+        reloads += 1
+        # the generator may have missed what changed during the reload,
+        # cron-update.path would not trigger again while this runs
+        if reloads == 10 or not watcher.wait(0):
+            break
+    after = snapshot()
+
+    stopped, started, changed = update(before, after, args.dry_run)
+    unchanged = sum(1 for name in after if before.get(name) == after[name])
+
+    print('%d changes to %d crontabs coalesced in %d reload(s) after %.1fs (%s)' %
+          (watcher.events, len(watcher.changed), reloads, time.monotonic() - start,
+           type(watcher).__name__.lower()))
+    for path in sorted(watcher.changed)[:20]:
+        print('    %s' % path)
+    if len(watcher.changed) > 20:
+        print('    ...')
+    print('%d timers started, %d restarted, %d stopped, %d unchanged' %
+          (len(started), len(changed), len(stopped), unchanged))
+
+if __name__ == '__main__':
+    main()
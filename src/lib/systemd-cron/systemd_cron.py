@@ -0,0 +1,1194 @@
+'''crontab parser & unit renderer shared by
+   systemd-crontab-generator and /usr/bin/crontab'''
+import os
+import pwd
+import re
+import stat
+import string
+import sys
+from contextlib import contextmanager
+from functools import lru_cache, reduce, wraps
+from types import MappingProxyType
+from typing import Callable, Iterator, Mapping, Optional, Protocol
+from enum import IntEnum
+
+# hashlib, json, tempfile & time are only imported when needed,
+# /usr/bin/crontab must start fast
+
+envvar_re = re.compile(r'^([A-Za-z_0-9]+)\s*=\s*(.*)$')
+spaces_re = re.compile(r' {2,}')
+
+MINUTES_SET = list(range(0, 60))
+HOURS_SET = list(range(0, 24))
+DAYS_SET = list(range(1, 32))
+DOWS_SET = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS_SET = list(range(1, 13))
+
+KSH_SHELLS = ['/bin/sh', '/bin/dash', '/bin/ksh', '/bin/bash', '/usr/bin/zsh']
+REBOOT_FILE = '/run/crond.reboot'
+# set by the generator
+TARGET_DIR = '/run/systemd/generator'
+
+USE_LOGLEVELMAX = "@use_loglevelmax@"
+RANDOMIZED_DELAY = "@randomized_delay@" == "True"
+PERSISTENT = "@persistent@" == "True"
+AGGREGATE = "@aggregate@" == "True"
+STABLE_NAMES = "@stable_names@" == "True"
+NATIVE_BOOT_DELAY = "@native_boot_delay@" == "True"
+LIBDIR = "@libdir@"
+# per-user slices, see slice_policy()
+SLICES_CONF = "@confdir@/systemd-cron/slices.conf"
+STATEDIR = "@statedir@"
+CACHEDIR = "@cachedir@"
+# parsed user crontabs, written by /usr/bin/crontab, see parse_crontab_cached()
+# empty to neither read nor write the cache
+PARSED_DIR = os.path.join(CACHEDIR, 'parsed')
+PARSED_VERSION = 4
+PARSED_MAX_AGE = 7 * 24 * 3600
+# what read_crontab() found on each line
+PARSED_FIELDS = ['line', 'lineno', 'environment', 'shell', 'boot_delay', 'start_hour',
+                 'random_delay', 'persistent', 'batch', 'aggregate', 'period',
+                 'resources', 'max_jobs',
+                 'timespec_minute', 'timespec_hour', 'timespec_dom',
+                 'timespec_dow', 'timespec_month', 'sunday_is_seven',
+                 'command', 'valid']
+STATS_REPORT = 'systemd-cron-stats.json'
+# what Job.log() said while a crontab was parsed, kept in PARSED_DIR with the jobs
+captured:Optional[list[list]] = None
+
+SELF = os.path.basename(sys.argv[0])
+# systemd runs the generators with three folders, they log to the kernel
+KMSG = len(sys.argv) == 4
+VALID_CHARS = "-_" + string.ascii_letters + string.digits
+
+# crontab variables and slices.conf keys -> resource control settings
+RESOURCE_CONTROLS = {
+    'CPU_WEIGHT': ('CPUWeight', re.compile(r'^([1-9][0-9]{0,3}|10000)$')),
+    'IO_WEIGHT': ('IOWeight', re.compile(r'^([1-9][0-9]{0,3}|10000)$')),
+    'MEMORY_MAX': ('MemoryMax', re.compile(r'^([0-9]+[KMGT]?|[0-9]+%|infinity)$')),
+}
+
+for pgm in ('/usr/sbin/sendmail', '/usr/lib/sendmail'):
+    if os.path.exists(pgm):
+        HAS_SENDMAIL = True
+        break
+else:
+    HAS_SENDMAIL = False
+
+class Log(IntEnum):
+    EMERG = 0
+    ALERT = 1
+    CRIT = 2
+    ERR = 3
+    WARNING = 4
+    NOTICE = 5
+    INFO = 6
+    DEBUG = 7
+
+def setting(name:str, flag:str='yes') -> Optional[str]:
+    '''SYSTEMD_CRON_<NAME> in the environment, overridden by
+       systemd_cron.<name>[=value] on the kernel command line'''
+    value = os.environ.get('SYSTEMD_CRON_' + name.upper())
+    try:
+        with open('/proc/cmdline', 'r') as f:
+            for option in f.read().split():
+                key, _, arg = option.partition('=')
+                if key.replace('-', '_') == 'systemd_cron.' + name:
+                    value = arg or flag
+    except OSError:
+        pass
+    return value
+
+class Stats:
+    '''counters and phase durations of a run, enabled with
+       SYSTEMD_CRON_STATS=yes|json in the environment
+       or systemd_cron.stats[=json] on the kernel command line'''
+    enabled:bool
+    report:bool
+    counters:dict[str, int]
+    phases:dict[str, float]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.report = False
+        self.clear()
+
+    def clear(self) -> None:
+        self.counters = dict()
+        self.phases = dict()
+
+    def configure(self) -> None:
+        value = setting('stats')
+        if value is None:
+            return
+        value = value.lower()
+        self.enabled = value in ['yes', 'true', '1', 'json']
+        self.report = value == 'json'
+
+    def count(self, name:str, n:int=1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name:str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        import time
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    def timed(self, name:str) -> Callable:
+        '''decorator version of phase()'''
+        def decorator(function:Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def merge(self, other:dict) -> None:
+        '''add the figures of a worker process'''
+        for name, n in other['counters'].items():
+            self.count(name, n)
+        for name, duration in other['phases'].items():
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def dump(self) -> dict:
+        return {'counters': self.counters, 'phases': self.phases}
+
+    def write(self) -> None:
+        if not self.enabled:
+            return
+        log(Log.INFO, 'stats: %s' % ' '.join(
+            ['%s=%.3fs' % item for item in sorted(self.phases.items())] +
+            ['%s=%d' % item for item in sorted(self.counters.items())]))
+        if self.report:
+            import json
+            with open(os.path.join(TARGET_DIR, STATS_REPORT), 'w', encoding='utf8') as f:
+                json.dump(self.dump(), f, indent=2, sort_keys=True)
+                f.write('\n')
+
+stats = Stats()
+
+class Units(Protocol):
+    '''what Job.output() needs of the Source of the generator'''
+    delays:dict[str, int]
+
+    def add(self, name:str, content:str) -> None: ...
+
+class Job:
+    '''Job definition'''
+    filename:str
+    basename:str
+    line:str
+    lineno:int
+    parts:list[str]
+    environment:Mapping[str, str]
+    shell:str
+    random_delay:int
+    # either period or timespec
+    period:str
+    # bitmasks, see compile_timespec()
+    timespec_minute:int # 0-59
+    timespec_hour:int # 0-23
+    timespec_dom:int # 1-31
+    timespec_dow:int # 0-6
+    timespec_month:int # 1-12
+    sunday_is_seven:bool
+    schedule:str
+    boot_delay:int
+    start_hour:int
+    persistent:bool
+    batch:bool
+    aggregate:bool
+    # CPUWeight=... of the service, see RESOURCE_CONTROLS
+    resources:dict[str, str]
+    max_jobs:int
+    # jobs sharing this unit, see generate_group_units()
+    group:list['Job']
+    jobid:str
+    unit_name:str
+    user:str
+    home:Optional[str]
+    command:list[str]
+    execstart:str
+    scriptlet:str
+    valid:bool
+    standardoutput:Optional[str]
+    testremoved:Optional[str]
+    probes:dict[str, bool]
+
+    def __init__(self, filename:str, line:str) -> None:
+        self.filename = filename
+        self.basename = os.path.basename(filename)
+        self.line = line
+        self.lineno = 0
+        self.parts = line.split()
+        self.environment = dict()
+        self.shell = '/bin/sh'
+        self.boot_delay = 0
+        self.start_hour = 0
+        self.random_delay = 0
+        self.persistent = False
+        self.user = 'root'
+        self.home = None
+        self.command = []
+        self.valid = True
+        self.batch = False
+        self.aggregate = AGGREGATE
+        self.resources = dict()
+        self.max_jobs = 0
+        self.group = []
+        self.standardoutput = None
+        self.testremoved = None
+        self.probes = dict()
+        self.period = ''
+        self.timespec_minute = 0
+        self.timespec_hour = 0
+        self.timespec_dow = 0
+        self.timespec_dom = 0
+        self.timespec_month = 0
+        self.sunday_is_seven = False
+        self.schedule = ''
+
+    def log(self, priority:int, message:str) -> None:
+        if captured is not None:
+            captured.append([priority, message, self.line])
+        log(priority, '%s in %s:%s' % (message, self.filename, self.line))
+
+    def fork_environment(self) -> dict[str, str]:
+        '''the jobs of a crontab share the same environment snapshot,
+           a job only gets its own copy once it needs to modify it'''
+        if not isinstance(self.environment, dict):
+            self.environment = dict(self.environment)
+        return self.environment
+
+    def isfile(self, path:str) -> bool:
+        '''os.path.isfile(), remembered for the manifest'''
+        stats.count('stat')
+        self.probes[path] = os.path.isfile(path)
+        return self.probes[path]
+
+    def decode_environment(self, default_persistent:bool) -> None:
+        '''decode some environment variables that influence
+           the behaviour of systemd-cron itself'''
+
+        if 'SHELL' in self.environment:
+            self.shell = self.environment['SHELL']
+
+        if 'PERSISTENT' in self.environment:
+            self.persistent = self.environment['PERSISTENT'].lower() in ['yes', 'true', '1']
+            del self.fork_environment()['PERSISTENT']
+        else:
+            self.persistent = default_persistent
+
+        if 'MAILTO' in self.environment and self.environment['MAILTO']:
+            if not HAS_SENDMAIL:
+               self.log(Log.WARNING, 'a MTA is not installed, but MAILTO is set')
+
+        if 'RANDOM_DELAY' in self.environment:
+            try:
+                self.random_delay = int(self.environment['RANDOM_DELAY'])
+                del self.fork_environment()['RANDOM_DELAY']
+            except ValueError:
+                self.log(Log.WARNING, 'invalid RANDOM_DELAY')
+
+        if 'START_HOURS_RANGE' in self.environment:
+            try:
+                self.start_hour = int(self.environment['STARTS_HOURS_RANGE'])
+                del self.fork_environment()['STARTS_HOURS_RANGE']
+            except ValueError:
+                self.log(Log.WARNING, 'invalid START_HOURS_RANGE')
+
+        if 'DELAY' in self.environment:
+            try:
+                self.boot_delay = int(self.environment['DELAY'])
+                del self.fork_environment()['DELAY']
+            except ValueError:
+                self.log(Log.WARNING, 'invalid DELAY')
+
+        if 'BATCH' in self.environment:
+            self.batch = self.environment['BATCH'].lower() in ['yes','true','1']
+            del self.fork_environment()['BATCH']
+
+        if 'AGGREGATE' in self.environment:
+            self.aggregate = self.environment['AGGREGATE'].lower() in ['yes','true','1']
+            del self.fork_environment()['AGGREGATE']
+
+        for key, (setting, valid) in RESOURCE_CONTROLS.items():
+            if key in self.environment:
+                if valid.match(self.environment[key]):
+                    self.resources[setting] = self.environment[key]
+                else:
+                    self.log(Log.WARNING, 'invalid %s' % key)
+                del self.fork_environment()[key]
+
+        if 'MAX_JOBS' in self.environment:
+            try:
+                self.max_jobs = max(0, int(self.environment['MAX_JOBS']))
+                del self.fork_environment()['MAX_JOBS']
+            except ValueError:
+                self.log(Log.WARNING, 'invalid MAX_JOBS')
+
+    def parse_anacrontab(self) -> None:
+        if len(self.parts) < 4:
+            self.valid = False
+            return
+
+        self.period, delay, jobid = self.parts[0:3]
+        self.jobid = 'anacron-' + jobid
+        try:
+            self.boot_delay = int(delay)
+        except ValueError:
+            self.log(Log.WARNING, 'invalid DELAY')
+        self.command = self.parts[3:]
+
+    def parse_crontab_auto(self) -> None:
+        '''crontab --translate <something>'''
+        if self.line.startswith('@'):
+            self.parse_crontab_at(False)
+        else:
+            self.parse_crontab_timespec(False)
+
+        if self.command:
+            if len(self.command) > 1:
+                maybe_user = self.command[0]
+                if getpwnam(maybe_user):
+                    self.user = maybe_user
+                    self.command = self.command[1:]
+                else:
+                    self.user = os.getlogin()
+            else:
+                self.user = os.getlogin()
+
+            pgm = which(self.command[0], self.environment.get('PATH'))
+            if pgm:
+                self.command[0] = pgm
+            self.execstart = ' '.join(self.command)
+
+    def parse_crontab_at(self, withuser:bool) -> None:
+        '''@daily (user) do something'''
+        if len(self.parts) < (2 + int(withuser)):
+            self.valid = False
+            return
+
+        self.period = self.parts[0]
+        if withuser:
+            self.user = self.parts[1]
+            self.command = self.parts[2:]
+        else:
+            self.user = self.basename
+            self.command = self.parts[1:]
+        self.jobid = self.basename + '-' + self.user
+
+    def parse_crontab_timespec(self, withuser:bool) -> None:
+        '''6 2 * * * (user) do something'''
+        if len(self.parts) < (6 + int(withuser)):
+            self.valid = False
+            return
+
+        minutes, hours, days, months, dows = self.parts[0:5]
+        self.timespec_minute = self.parse_time_unit('minute', minutes)
+        self.timespec_hour = self.parse_time_unit('hour', hours)
+        self.timespec_dom = self.parse_time_unit('dom', days)
+        self.timespec_dow = self.parse_time_unit('dow', dows)
+        self.sunday_is_seven = dows.endswith('7') or dows.lower().endswith('sun')
+        self.timespec_month = self.parse_time_unit('month', months)
+
+        if withuser:
+            self.user = self.parts[5]
+            self.command = self.parts[6:]
+        else:
+            self.user = self.basename
+            self.command = self.parts[5:]
+        self.jobid = self.basename + '-' + self.user
+
+    def parse_time_unit(self, field:str, value:str) -> int:
+        result = compile_timespec(field, value)
+        if not result:
+            self.log(Log.ERR, 'garbled time')
+            self.valid = False
+        return result
+
+    def dump(self) -> dict:
+        '''state before decode(), see parse_crontab_cached()'''
+        record = {field: getattr(self, field) for field in PARSED_FIELDS}
+        record['environment'] = dict(self.environment)
+        return record
+
+    def decode(self):
+        '''decode & validate'''
+        self.jobid = ''.join(c for c in self.jobid if c in VALID_CHARS)
+        self.decode_command()
+
+    def decode_command(self) -> None:
+        '''perform smart substitutions for known shells'''
+        if self.shell not in KSH_SHELLS:
+            return
+
+        entry = getpwnam(self.user)
+        if entry:
+            self.home = entry.pw_dir
+        if self.home:
+            if self.command[0].startswith('~/'):
+                self.command[0] = self.home + self.command[0][2:]
+
+            if 'PATH' in self.environment:
+                parts = self.environment['PATH'].split(':')
+                for i, part in enumerate(parts):
+                    if part.startswith('~/'):
+                        parts[i] = self.home + part[1:]
+                path = ':'.join(parts)
+                if path != self.environment['PATH']:
+                    self.fork_environment()['PATH'] = path
+
+
+        if (len(self.command) >= 3 and
+            self.command[-2] == '>' and
+            self.command[-1] == '/dev/null'):
+            self.command = self.command[0:-2]
+            self.standardoutput = '/dev/null'
+
+        if (len(self.command) >= 2 and
+            self.command[-1] == '>/dev/null'):
+            self.command = self.command[0:-1]
+            self.standardoutput = '/dev/null'
+
+        if (len(self.command) == 6 and
+            self.command[0] == '[' and
+            self.command[1] in ['-x','-f','-e'] and
+            self.command[2] == self.command[5] and
+            self.command[3] == ']' and
+            self.command[4] == '&&' ):
+                self.testremoved = self.command[2]
+                self.command = self.command[5:]
+
+        if (len(self.command) == 5 and
+            self.command[0] == 'test' and
+            self.command[1] in ['-x','-f','-e'] and
+            self.command[2] == self.command[4] and
+            self.command[3] == '&&' ):
+                self.testremoved = self.command[2]
+                self.command = self.command[4:]
+
+    def is_active(self) -> bool:
+        if self.testremoved and not self.isfile(self.testremoved):
+            log(Log.NOTICE, '%s is removed, skipping job' % self.testremoved)
+            return False
+
+        if self.schedule == 'reboot' and self.isfile(REBOOT_FILE):
+            return False
+
+        if (len(self.command) == 6 and
+            self.command[0] == '[' and
+            self.command[1] in ['-d','-e'] and
+            self.command[2].startswith('/run/systemd') and
+            self.command[3] == ']' and
+            self.command[4] == '||'):
+            return False
+
+        if (len(self.command) == 5 and
+            self.command[0] == 'test' and
+            self.command[1] in ['-d','-e'] and
+            self.command[2].startswith('/run/systemd') and
+            self.command[3] == '||'):
+            return False
+
+        return True
+
+    def generate_schedule(self) -> None:
+        if self.period:
+             self.generate_schedule_from_period()
+        else:
+             self.generate_schedule_from_timespec()
+
+    def generate_schedule_from_period(self) -> None:
+        TIME_UNITS_SET = ['daily', 'weekly', 'monthly',
+                          'quarterly', 'semi-annually', 'yearly']
+        hour = self.start_hour
+
+        self.period = self.period.lower().lstrip('@')
+        self.period = {
+                'boot': 'reboot',
+                '1': 'daily',
+                '7': 'weekly',
+                '30': 'monthly',
+                '31': 'monthly',
+                'biannually': 'semi-annually',
+                'bi-annually': 'semi-annually',
+                'semiannually': 'semi-annually',
+                'anually': 'yearly',
+                'annually': 'yearly',
+                '365': 'yearly',
+        }.get(self.period, self.period)
+
+        if self.period == 'reboot':
+            self.boot_delay = max(self.boot_delay, 1)
+            self.schedule = self.period
+            self.persistent = False
+        elif self.period == 'minutely':
+            self.schedule = self.period
+            self.persistent = False
+        elif self.period == 'hourly' and self.boot_delay == 0:
+            self.schedule = 'hourly'
+        elif self.period == 'hourly':
+            self.schedule = '*-*-* *:%s:0' % self.boot_delay
+            self.boot_delay = 0
+        elif self.period == 'midnight' and self.boot_delay == 0:
+            self.schedule = 'daily'
+        elif self.period == 'midnight':
+            self.schedule = '*-*-* 0:%s:0' % self.boot_delay
+        elif self.period in TIME_UNITS_SET and hour == 0 and self.boot_delay == 0:
+            self.schedule = self.period
+        elif self.period == 'daily':
+            self.schedule = '*-*-* %s:%s:0' % (hour, self.boot_delay)
+        elif self.period == 'weekly':
+            self.schedule = 'Mon *-*-* %s:%s:0' % (hour, self.boot_delay)
+        elif self.period == 'monthly':
+            self.schedule = '*-*-1 %s:%s:0' % (hour, self.boot_delay)
+        elif self.period == 'quarterly':
+            self.schedule = '*-1,4,7,10-1 %s:%s:0' % (hour, self.boot_delay)
+        elif self.period == 'semi-annually':
+            self.schedule = '*-1,7-1 %s:%s:0' % (hour, self.boot_delay)
+        elif self.period == 'yearly':
+            self.schedule = '*-1-1 %s:%s:0' % (hour, self.boot_delay)
+        else:
+            try:
+               period = int(self.period)
+               assert type(period) is int
+               if period > 31:
+                    # workaround for anacrontab
+                    divisor = int(round(period / 30))
+                    self.schedule = '*-1/%s-1 %s:%s:0' % (divisor, hour, self.boot_delay)
+               else:
+                    self.schedule = '*-*-1/%s %s:%s:0' % (self.period, hour, self.boot_delay)
+            except ValueError:
+               self.log(Log.ERR, 'unknown schedule')
+               self.schedule = self.period
+
+    def generate_schedule_from_timespec(self) -> None:
+        if (not self.timespec_month or
+           not self.timespec_dom or
+           not self.timespec_hour or
+           not self.timespec_minute):
+            self.valid = False
+            self.log(Log.ERR, 'unknown schedule')
+            return None
+
+        keyword = CALENDAR_KEYWORDS.get((self.timespec_dow,
+                                         self.timespec_month,
+                                         self.timespec_dom,
+                                         self.timespec_hour,
+                                         self.timespec_minute))
+        if keyword:
+            self.schedule = keyword
+            return None
+
+        dows = render_timespec('dow', self.timespec_dow, self.sunday_is_seven)
+        self.schedule = '%s*-%s-%s %s:%s:00' % (
+                      dows + ' ' if dows else '',
+                      render_timespec('month', self.timespec_month),
+                      render_timespec('dom', self.timespec_dom),
+                      render_timespec('hour', self.timespec_hour),
+                      render_timespec('minute', self.timespec_minute)
+                   )
+
+    def generate_scriptlet(self) -> Optional[str]:
+        '''...only if needed'''
+        assert self.unit_name
+        if self.group:
+            self.scriptlet = os.path.join(TARGET_DIR, '%s.sh' % self.unit_name)
+            self.execstart = self.shell + ' ' + self.scriptlet
+            return self.generate_group_scriptlet()
+
+        if len(self.command) == 1:
+            if self.isfile(self.command[0]):
+                self.execstart = self.command[0]
+                return None
+            else:
+                pgm = which(self.command[0], self.environment.get('PATH'))
+                if pgm:
+                    self.isfile(pgm)
+                    self.execstart = pgm
+                    return None
+
+        self.scriptlet = os.path.join(TARGET_DIR, '%s.sh' % self.unit_name)
+        self.execstart = self.shell + ' ' + self.scriptlet
+        return ' '.join(self.command)
+
+    def generate_group_scriptlet(self) -> str:
+        '''run all the commands at once, like cron would,
+           and tell which ones failed'''
+        lines = list()
+        for i, job in enumerate(self.group, 1):
+            lines.append('(')
+            lines.append(' '.join(job.command))
+            lines.append(') &')
+            lines.append('pid%d=$!' % i)
+        lines.append('status=0')
+        for i in range(1, len(self.group) + 1):
+            lines.append('wait $pid%d || { rc=$?; echo "systemd-cron: job %d of %d failed with status $rc" >&2; status=1; }'
+                         % (i, i, len(self.group)))
+        lines.append('exit $status')
+        return '\n'.join(lines)
+
+    def group_key(self) -> tuple:
+        '''jobs with the same key can share the same timer & service'''
+        return (self.user, self.schedule, self.persistent, self.boot_delay,
+                self.random_delay, self.batch, self.shell, self.standardoutput,
+                self.testremoved, tuple(sorted(self.environment.items())),
+                tuple(sorted(self.resources.items())), self.max_jobs)
+
+    def generate_service(self) -> str:
+        lines = list()
+        lines.append('[Unit]')
+        lines.append('Description=[Cron] "%s"' % self.line.replace('%', '%%'))
+        lines.append('Documentation=man:systemd-crontab-generator(8)')
+        if self.filename != '-':
+            lines.append('SourcePath=%s' % self.filename)
+        if 'MAILTO' in self.environment and not self.environment['MAILTO']:
+            pass # mails explicitely disabled
+        elif not HAS_SENDMAIL:
+            pass # mails automaticaly disabled
+        else:
+            lines.append('OnFailure=cron-failure@%i.service')
+        if self.user != 'root' or STATEDIR in self.filename:
+            lines.append('Requires=systemd-user-sessions.service')
+            if self.home:
+                lines.append('RequiresMountsFor=%s' % self.home)
+        lines.append('')
+
+        lines.append('[Service]')
+        lines.append('Type=oneshot')
+        lines.append('IgnoreSIGPIPE=false')
+        lines.append('KillMode=process')
+        if USE_LOGLEVELMAX != 'no':
+            lines.append('LogLevelMax=%s' % USE_LOGLEVELMAX)
+        if self.schedule and self.boot_delay and not NATIVE_BOOT_DELAY:
+            lines.append('ExecStartPre=-%s/systemd-cron/boot_delay %s' % (LIBDIR, self.boot_delay))
+        policy = slice_policy(self.user)
+        max_jobs = min(filter(None, [self.max_jobs, int(policy.get('MAX_JOBS', 0))]), default=0)
+        if max_jobs:
+            lines.append('ExecStart=%s/systemd-cron/job_slot %d /run/cron-slots/%s %s' %
+                         (LIBDIR, max_jobs, self.user, self.execstart))
+            # shared by all the jobs of the user, owned by them
+            lines.append('RuntimeDirectory=cron-slots/%s' % self.user)
+            lines.append('RuntimeDirectoryPreserve=yes')
+        else:
+            lines.append('ExecStart=%s' % self.execstart)
+        if self.environment:
+             lines.append('Environment=%s' % environment_string(self.environment))
+        lines.append('User=%s' % self.user)
+        if self.standardoutput:
+             lines.append('StandardOutput=%s' % self.standardoutput)
+        if self.batch:
+             lines.append('CPUSchedulingPolicy=idle')
+             lines.append('IOSchedulingClass=idle')
+        if load_slices() is not None or self.resources or self.max_jobs:
+             lines.append('Slice=%s.slice' % slice_name(self.user))
+        for setting, value in sorted(self.resources.items()):
+             lines.append('%s=%s' % (setting, value))
+        for job in self.group:
+             # read back by mail_on_failure
+             lines.append('X-CronJob=%s' % job.line)
+
+        return '\n'.join(lines)
+
+    def generate_timer(self) -> str:
+        lines = list()
+        lines.append('[Unit]')
+        lines.append('Description=[Timer] "%s"' % self.line.replace('%', '%%'))
+        lines.append('Documentation=man:systemd-crontab-generator(8)')
+        lines.append('PartOf=cron.target')
+        if self.filename != '-':
+            lines.append('SourcePath=%s' % self.filename)
+        if self.testremoved:
+            lines.append('ConditionFileIsExecutable=%s' % self.testremoved)
+        lines.append('')
+
+        lines.append('[Timer]')
+        if self.schedule == 'reboot':
+            lines.append('OnBootSec=%sm' % self.boot_delay)
+        else:
+            lines.append('OnCalendar=%s' % self.schedule)
+        if self.random_delay > 1:
+            if RANDOMIZED_DELAY:
+                lines.append('RandomizedDelaySec=%sm' % self.random_delay)
+            else:
+                lines.append('AccuracySec=%sm' % self.random_delay)
+        if self.persistent:
+            lines.append('Persistent=true')
+
+        return '\n'.join(lines)
+
+    def generate_unit_name(self, seq) -> None:
+        assert self.jobid
+        if not self.persistent and not STABLE_NAMES:
+            unit_id = next(seq)
+        else:
+            import hashlib
+            unit_id = hashlib.md5()
+            unit_id.update(bytes('\0'.join([self.schedule] + self.command), 'utf-8'))
+            unit_id = unit_id.hexdigest()
+        self.unit_name = "cron-%s-%s" % (self.jobid, unit_id)
+
+    @stats.timed('output')
+    def output(self, source:'Units') -> None:
+        '''queue the result for TARGET_DIR'''
+        assert self.unit_name
+
+        code = self.generate_scriptlet() # as a side-effect also changes self.execstart
+        if code:
+            source.add('%s.sh' % self.unit_name, code + '\n')
+
+        source.add('%s.timer' % self.unit_name, self.generate_timer() + '\n')
+        source.add('%s.service' % self.unit_name, self.generate_service() + '\n')
+        if load_slices() is not None or self.resources or self.max_jobs:
+            source.add('%s.slice' % slice_name(self.user), generate_slice(self.user) + '\n')
+        if NATIVE_BOOT_DELAY and self.boot_delay and self.schedule != 'reboot':
+            # the timer is only started once cron-delay-N.target is reached
+            source.delays[self.unit_name] = self.boot_delay
+
+
+def slice_name(user:str) -> str:
+    '''cron-<user>, escaped so that a dash does not nest it in another slice'''
+    return 'cron-' + ''.join(c if c in string.ascii_letters + string.digits + ':_.' else '\\x%02x' % ord(c)
+                             for c in user)
+
+@lru_cache(maxsize=None)
+def load_slices() -> Optional[dict[str, dict[str, str]]]:
+    '''user -> settings from SLICES_CONF, None without that file'''
+    try:
+        with open(SLICES_CONF, 'r', encoding='utf8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    slices:dict[str, dict[str, str]] = dict()
+    for lineno, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        policy = slices.setdefault(fields[0], dict())
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            if ((key in RESOURCE_CONTROLS and RESOURCE_CONTROLS[key][1].match(value)) or
+                (key == 'MAX_JOBS' and value.isdigit())):
+                policy[key] = value
+            else:
+                log(Log.WARNING, 'invalid %s in %s:%d' % (field, SLICES_CONF, lineno))
+    return slices
+
+def slice_policy(user:str) -> dict[str, str]:
+    '''the settings for this user, on top of those for "*"'''
+    slices = load_slices() or dict()
+    return dict(slices.get('*', dict()), **slices.get(user, dict()))
+
+def generate_slice(user:str) -> str:
+    lines = list()
+    lines.append('[Unit]')
+    lines.append('Description=systemd-cron jobs of %s' % user)
+    lines.append('Documentation=man:systemd.cron(7)')
+    lines.append('')
+    lines.append('[Slice]')
+    for key, value in sorted(slice_policy(user).items()):
+        if key in RESOURCE_CONTROLS:
+            lines.append('%s=%s' % (RESOURCE_CONTROLS[key][0], value))
+    return '\n'.join(lines)
+
+def file_version(filename:str) -> Optional[list[int]]:
+    try:
+        statbuf = os.stat(filename)
+        return [statbuf.st_mtime_ns, statbuf.st_size]
+    except OSError:
+        return None
+
+passwd:dict[str, Optional[pwd.struct_passwd]] = {}
+def getpwnam(user:str) -> Optional[pwd.struct_passwd]:
+    '''pwd.getpwnam(), each user is only resolved once per run'''
+    if user not in passwd:
+        stats.count('passwd_lookups')
+        with stats.phase('nss'):
+            try:
+                passwd[user] = pwd.getpwnam(user)
+            except KeyError:
+                passwd[user] = None
+    return passwd[user]
+
+def preload_passwd() -> None:
+    '''fill the cache with a single getpwall(); this may not enumerate
+       remote (LDAP, sssd...) users, those still go through getpwnam()'''
+    stats.count('passwd_lookups')
+    with stats.phase('nss'):
+        for entry in pwd.getpwall():
+            passwd.setdefault(entry.pw_name, entry)
+
+# PATH directory -> names it contains, each one is only listed once per run
+path_index:dict[str, frozenset[str]] = {}
+
+def list_path_dir(dirname:str) -> frozenset[str]:
+    if dirname not in path_index:
+        stats.count('listdir')
+        try:
+            path_index[dirname] = frozenset(os.listdir(dirname or '.'))
+        except OSError:
+            path_index[dirname] = frozenset()
+    return path_index[dirname]
+
+def which(exe:str, path:Optional[str]=None) -> Optional[str]:
+    '''search exe in the PATH= of the crontab, or else in our own PATH'''
+    return search_path(exe, path or os.environ.get('PATH', '/usr/bin:/bin'))
+
+@lru_cache(maxsize=None)
+@stats.timed('which')
+def search_path(exe:str, path:str) -> Optional[str]:
+    for dirname in path.split(os.pathsep):
+        if '/' not in exe and exe not in list_path_dir(dirname):
+            continue
+        stats.count('stat')
+        try:
+            abspath = os.path.join(dirname, exe)
+            statbuf = os.stat(abspath)
+        except OSError:
+            continue
+        if stat.S_IMODE(statbuf.st_mode) & 0o111:
+            return abspath
+
+    return None
+
+def environment_string(env:Mapping[str, str]) -> str:
+    line = []
+    for k, v in env.items():
+        if ' ' in v:
+            line.append('"%s=%s"' % (k, v))
+        else:
+            line.append('%s=%s' % (k, v))
+    return ' '.join(line)
+
+def read_crontab(filename:str,
+                 withuser:bool=True,
+                 monotonic:bool=False) -> Iterator[Job]:
+    '''the jobs as written in the file, not yet decoded'''
+
+    # immutable, shared by all the jobs until the next VAR=value line
+    environment:Mapping[str,str] = MappingProxyType(dict())
+    with open(filename, 'rb') as f:
+        # one line at a time, some generated files are huge
+        for lineno, rawline in enumerate(f, 1):
+            rawline = rawline.strip()
+            if not rawline or rawline.startswith(b'#'):
+                continue
+
+            try:
+                line = rawline.decode('utf8')
+            except UnicodeDecodeError:
+                # let's hope it's in a trailing comment
+                try:
+                    line = rawline.split(b'#')[0].decode('utf8')
+                except UnicodeDecodeError:
+                    line = rawline.decode('ascii', 'replace')
+
+            line = spaces_re.sub(' ', line)
+
+            envvar = envvar_re.match(line)
+            if envvar:
+                key = envvar.group(1)
+                value = envvar.group(2)
+                value = value.strip("'").strip('"').strip(' ')
+                environment = MappingProxyType({**environment, key: value})
+                continue
+
+            j = Job(filename, line)
+            j.lineno = lineno
+            j.environment = environment
+            if monotonic:
+                j.decode_environment(default_persistent=True)
+                j.parse_anacrontab()
+            elif line.startswith('@'):
+                j.decode_environment(default_persistent=True)
+                j.parse_crontab_at(withuser)
+            else:
+                j.decode_environment(default_persistent=False)
+                j.parse_crontab_timespec(withuser)
+            yield j
+
+def parse_crontab(filename:str,
+                  withuser:bool=True,
+                  monotonic:bool=False) -> Iterator[Job]:
+    '''parser shared with /usr/bin/crontab'''
+    for j in read_crontab(filename, withuser, monotonic):
+        yield decode_job(j)
+
+def decode_job(j:Job) -> Job:
+    j.decode()
+    j.generate_schedule()
+    stats.count('jobs_parsed')
+    if not j.valid:
+        stats.count('invalid_lines')
+    return j
+
+def parse_crontab_cached(filename:str) -> Iterator[Job]:
+    '''parse_crontab() for an user crontab, the lines are only read again
+       if /usr/bin/crontab did not already leave the result in PARSED_DIR;
+       the owner of the crontab is given by the filename, not the cache'''
+    import hashlib
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    global captured
+    parsed = load_parsed(digest)
+    if parsed is None:
+        captured = messages = []
+        try:
+            records = [j.dump() for j in read_crontab(filename, withuser=False)]
+        finally:
+            captured = None
+        save_parsed(digest, records, messages)
+    else:
+        stats.count('parsed_cache_hits')
+        records, messages = parsed
+        # a broken crontab is reported at each run, not only by the first one
+        for priority, message, line in messages:
+            log(priority, '%s in %s:%s' % (message, filename, line))
+
+    environment:Mapping[str,str] = MappingProxyType(dict())
+    for record in records:
+        j = Job(filename, record['line'])
+        for field in PARSED_FIELDS:
+            setattr(j, field, record[field])
+        if record['environment'] != environment:
+            environment = MappingProxyType(record['environment'])
+        j.environment = environment
+        j.user = j.basename
+        j.jobid = j.basename + '-' + j.user
+        yield decode_job(j)
+
+def load_parsed(digest:str) -> Optional[tuple[list[dict], list[list]]]:
+    '''the jobs and the messages, only trusting what root wrote'''
+    if not PARSED_DIR:
+        return None
+    import json
+    try:
+        fd = os.open(os.path.join(PARSED_DIR, digest + '.json'), os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with open(fd, 'r', encoding='utf8') as f:
+        statbuf = os.fstat(f.fileno())
+        if statbuf.st_uid != 0 or statbuf.st_mode & 0o077:
+            return None
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+    if (data.get('version') != PARSED_VERSION or
+        data.get('digest') != digest or
+        data.get('generator') != file_version(__file__)):
+        return None
+    try:
+        os.utime(os.path.join(PARSED_DIR, digest + '.json'))
+    except OSError:
+        pass
+    return data['jobs'], data['messages']
+
+def save_parsed(digest:str, records:list[dict], messages:list[list]) -> None:
+    if os.geteuid() != 0 or not PARSED_DIR:
+        return
+    import json
+    import tempfile
+    try:
+        os.makedirs(PARSED_DIR, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=PARSED_DIR, prefix='.')
+        with open(fd, 'w', encoding='utf8') as f:
+            json.dump({
+                'version': PARSED_VERSION,
+                'digest': digest,
+                'generator': file_version(__file__),
+                'jobs': records,
+                'messages': messages,
+            }, f)
+        os.rename(tmp, os.path.join(PARSED_DIR, digest + '.json'))
+    except OSError:
+        pass
+
+def prune_parsed() -> None:
+    '''forget the crontabs that did not show up for a while'''
+    if not PARSED_DIR:
+        return
+    import time
+    limit = time.time() - PARSED_MAX_AGE
+    try:
+        for entry in os.scandir(PARSED_DIR):
+            if entry.stat(follow_symlinks=False).st_mtime < limit:
+                os.unlink(entry.path)
+    except OSError:
+        pass
+
+
+def month_map(month:str) -> int:
+    try:
+        return int(month)
+    except ValueError:
+        return ['jan', 'feb', 'mar', 'apr',
+                'may', 'jun', 'jul', 'aug',
+                'sep', 'oct', 'nov', 'dec'].index(month.lower()[0:3]) + 1
+
+def dow_map(dow:str) -> int:
+    try:
+        return ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'].index(dow[0:3].lower())
+    except ValueError:
+        return int(dow) #% 7
+
+def parse_period(mapping=int, base=0):
+    def parser(value:str):
+        try:
+            range, step = value.split('/')
+        except ValueError:
+            range = value
+            step = '1'
+
+        if range == '*':
+            return slice(None, None, int(step))
+
+        try:
+            start, end = range.split('-')
+        except ValueError:
+            start = end = range
+
+        return slice(mapping(start) - 1 + int(not(bool(base))), mapping(end) + int(not(bool(base))), int(step))
+
+    return parser
+
+# field -> values, mapping of names
+TIMESPEC_FIELDS = {
+    'minute': (MINUTES_SET, int),
+    'hour': (HOURS_SET, int),
+    'dom': (DAYS_SET, int),
+    'month': (MONTHS_SET, month_map),
+    'dow': (DOWS_SET, dow_map),
+}
+
+@lru_cache(maxsize=1024)
+def compile_timespec(field:str, value:str) -> int:
+    '''crontab time field -> bitmask of the matching values, 0 if garbled
+
+       bit n stands for value n; for days of week 0 is Sunday'''
+    values, mapping = TIMESPEC_FIELDS[field]
+    base = 0 if field == 'dow' else values[0]
+    mask = 0
+    try:
+        for part in value.split(','):
+            for i in range(len(values))[parse_period(mapping, base)(part)]:
+                mask |= 1 << (i % 7 if field == 'dow' else values[i])
+    except ValueError:
+        return 0
+    return mask
+
+def timespec_order(field:str, sunday_is_seven:bool=False) -> list[int]:
+    if field == 'dow':
+        return [1, 2, 3, 4, 5, 6, 0] if sunday_is_seven else [0, 1, 2, 3, 4, 5, 6]
+    return TIMESPEC_FIELDS[field][0]
+
+def timespec_names(field:str) -> list[str]:
+    if field == 'dow':
+        return DOWS_SET
+    return list(map(str, range(TIMESPEC_FIELDS[field][0][-1] + 1)))
+
+def compress_timespec(field:str, selected:list[int]) -> list[str]:
+    '''runs of 3 or more consecutive values -> ranges'''
+    names = timespec_names(field)
+    runs:list[list[int]] = []
+    for value in selected:
+        # systemd weeks start on Monday, so "Sun..Mon" is not a valid range
+        if runs and (value == runs[-1][-1] + 1 if field != 'dow' else
+                     (value - 1) % 7 == (runs[-1][-1] - 1) % 7 + 1):
+            runs[-1].append(value)
+        else:
+            runs.append([value])
+
+    items = []
+    for run in runs:
+        if len(run) >= 3:
+            items.append('%s..%s' % (names[run[0]], names[run[-1]]))
+        else:
+            items.extend(names[value] for value in run)
+    return items
+
+@lru_cache(maxsize=1024)
+def render_timespec(field:str, mask:int, sunday_is_seven:bool=False) -> str:
+    '''bitmask -> shortest OnCalendar= component
+
+       Consecutive values are written as ranges (1..5, Mon..Fri), values
+       repeating up to the end of the field as repetitions (0/5).
+       An empty string stands for all the days of week.'''
+    order = timespec_order(field, sunday_is_seven)
+    selected = [value for value in order if mask & (1 << value)]
+    if len(selected) == len(order):
+        return '' if field == 'dow' else '*'
+
+    best = ','.join(compress_timespec(field, selected))
+    if field != 'dow':
+        last = order[-1]
+        for start in selected:
+            for step in range(2, (last - start) // 2 + 1):
+                repeat = range(start, last + 1, step)
+                if not all(mask & (1 << value) for value in repeat):
+                    continue
+                rest = [value for value in selected if value not in repeat]
+                candidate = ','.join(['%s/%s' % (start, step)] + compress_timespec(field, rest))
+                if len(candidate) < len(best):
+                    best = candidate
+
+    if expand_timespec(field, best) != mask:
+        # should not happen
+        log(Log.WARNING, 'invalid optimization of %s field: %s' % (field, best))
+        best = ','.join(timespec_names(field)[value] for value in selected)
+    return best
+
+@lru_cache(maxsize=1024)
+def expand_timespec(field:str, text:str) -> int:
+    '''OnCalendar= component -> bitmask, the reverse of render_timespec()'''
+    order = timespec_order(field)
+    names = timespec_names(field)
+    if text in ('', '*'):
+        return reduce(lambda mask, value: mask | (1 << value), order, 0)
+
+    mask = 0
+    for item in text.split(','):
+        if '..' in item:
+            start, end = item.split('..')
+            # days of week ranges go from Monday to Sunday
+            span = timespec_order(field, sunday_is_seven=True)
+            values = span[span.index(names.index(start)):span.index(names.index(end)) + 1]
+        elif '/' in item:
+            start, step = item.split('/')
+            values = list(range(int(start), order[-1] + 1, int(step)))
+        else:
+            values = [names.index(item)]
+        for value in values:
+            mask |= 1 << value
+    return mask
+
+# OnCalendar= shorthands, as defined in systemd.time(7)
+CALENDAR_KEYWORDS = {
+    tuple(map(expand_timespec, ['dow', 'month', 'dom', 'hour', 'minute'], spec)): keyword
+    for keyword, spec in (
+        ('minutely', ('', '*', '*', '*', '*')),
+        ('hourly', ('', '*', '*', '*', '0')),
+        ('daily', ('', '*', '*', '0', '0')),
+        ('weekly', ('Mon', '*', '*', '0', '0')),
+        ('monthly', ('', '*', '1', '0', '0')),
+        ('quarterly', ('', '1,4,7,10', '1', '0', '0')),
+        ('semi-annually', ('', '1,7', '1', '0', '0')),
+        ('yearly', ('', '1', '1', '0', '0')),
+    )
+}
+
+def log(level:int, message:str) -> None:
+    if KMSG:
+        with open('/dev/kmsg', 'w', encoding='utf8') as kmsg:
+            kmsg.write('<%s>%s[%s]: %s\n' % (level, SELF, os.getpid(), message))
+    else:
+        sys.stderr.write('%s: %s\n' % (SELF, message))
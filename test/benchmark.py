@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+'''
+measure systemd-crontab-generator on a synthetic crontab corpus
+
+A fake root is populated with /etc/crontab, /etc/cron.d/*, /etc/anacrontab
+and user crontabs, then the generator is run twice against the same target
+folder: once cold, and once again with the manifest of the first run.
+
+With --startup, only the cost of loading the shared parser and reading one
+crontab is measured instead, as paid by each crontab invocation: once
+without bytecode, and once with the bytecode left by the first run.
+'''
+import argparse
+import importlib.machinery
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'src', 'bin', 'systemd-crontab-generator.py')
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'src', 'lib', 'systemd-cron')
+
+TIMESPECS = [
+    '* * * * *',
+    '*/5 * * * *',
+    '*/15 * * * *',
+    '0 * * * *',
+    '30 2 * * *',
+    '0 4 * * 0',
+    '15 3 1 * *',
+    '0 8-18 * * mon-fri',
+    '0,30 9-17 * * 1-5',
+    '45 23 * jan,jul *',
+    '0 0 1 */3 *',
+    '20 6 * * sat,sun',
+]
+PERIODS = ['@reboot', '@hourly', '@daily', '@weekly', '@monthly', '@yearly']
+COMMANDS = [
+    'true',
+    '/bin/true',
+    'echo hello',
+    'test -x /usr/sbin/missing && /usr/sbin/missing --quiet',
+    '[ -d /tmp ] && find /tmp -maxdepth 1 -mtime +7 -delete',
+    'cd ~/work && ./sync.sh >/dev/null 2>&1',
+    'date >> /tmp/benchmark.log',
+    '/usr/bin/env python3 -c pass',
+]
+ENVIRONMENT = [
+    'MAILTO=admin@example.com',
+    'PATH=/usr/local/bin:/usr/bin:/bin',
+    'RANDOM_DELAY=10',
+    'SHELL=/bin/bash',
+    'BATCH=yes',
+]
+
+def crontab(rng:random.Random, lines:int, user:str='') -> str:
+    out = ['# synthetic crontab']
+    for _ in range(lines):
+        roll = rng.random()
+        if roll < 0.05:
+            out.append(rng.choice(ENVIRONMENT))
+        elif roll < 0.10:
+            out.append('# ' + rng.choice(COMMANDS))
+        elif roll < 0.25:
+            out.append(' '.join(filter(None, [rng.choice(PERIODS), user, rng.choice(COMMANDS)])))
+        else:
+            out.append(' '.join(filter(None, [rng.choice(TIMESPECS), user, rng.choice(COMMANDS)])))
+    return '\n'.join(out) + '\n'
+
+def populate(root:str, args:argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    for folder in ('etc/cron.d', 'etc/cron.daily', 'var/spool/cron',
+                   'var/cache/systemd-cron', 'run'):
+        os.makedirs(os.path.join(root, folder))
+
+    with open(os.path.join(root, 'etc/crontab'), 'w') as f:
+        f.write('SHELL=/bin/sh\nPATH=/usr/local/sbin:/usr/local/bin:/sbin:/bin:/usr/sbin:/usr/bin\n')
+        f.write(crontab(rng, args.lines, 'root'))
+    for i in range(args.crond):
+        with open(os.path.join(root, 'etc/cron.d', 'package%d' % i), 'w') as f:
+            f.write(crontab(rng, args.lines, rng.choice(['root', 'nobody', 'daemon'])))
+    for i in range(args.parts):
+        path = os.path.join(root, 'etc/cron.daily', 'script%d' % i)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\ntrue\n')
+        os.chmod(path, 0o755)
+    with open(os.path.join(root, 'etc/anacrontab'), 'w') as f:
+        f.write('SHELL=/bin/sh\n')
+        for i in range(args.lines):
+            f.write('%s %d job%d %s\n' % (rng.choice(['1', '7', '@monthly']),
+                                          rng.randint(0, 30), i, rng.choice(COMMANDS)))
+    for i in range(args.users):
+        with open(os.path.join(root, 'var/spool/cron', 'user%d' % i), 'w') as f:
+            f.write(crontab(rng, args.lines))
+
+class Phases:
+    '''exclusive time spent in each instrumented function'''
+    def __init__(self) -> None:
+        self.totals:dict[str, float] = dict()
+        self.stack:list[list] = [['main', time.perf_counter()]]
+
+    def enter(self, name:str) -> None:
+        now = time.perf_counter()
+        current = self.stack[-1]
+        self.totals[current[0]] = self.totals.get(current[0], 0.0) + now - current[1]
+        self.stack.append([name, now])
+
+    def leave(self) -> None:
+        now = time.perf_counter()
+        name, start = self.stack.pop()
+        self.totals[name] = self.totals.get(name, 0.0) + now - start
+        self.stack[-1][1] = now
+
+    def finish(self) -> dict[str, float]:
+        name, start = self.stack.pop()
+        self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+        return self.totals
+
+    def wrap(self, name:str, function):
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+    def wrap_iterator(self, name:str, function):
+        def wrapper(*args, **kwargs):
+            iterator = self.wrap(name, function)(*args, **kwargs)
+            while True:
+                self.enter(name)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave()
+                yield item
+        return wrapper
+
+def child(root:str, target:str) -> None:
+    '''run the generator in this process, against the fake root'''
+    sys.argv = [GENERATOR, target]
+    sys.path.insert(0, LIB_DIR)
+    loader = importlib.machinery.SourceFileLoader('generator', GENERATOR)
+    generator = loader.load_module()
+    parser = generator.systemd_cron
+
+    parser.STATEDIR = os.path.join(root, 'var/spool/cron')
+    parser.CACHEDIR = os.path.join(root, 'var/cache/systemd-cron')
+    parser.PARSED_DIR = os.path.join(parser.CACHEDIR, 'parsed')
+    parser.REBOOT_FILE = os.path.join(root, 'run/crond.reboot')
+    parser.TARGET_DIR = target
+    generator.CRONTAB = os.path.join(root, 'etc/crontab')
+    generator.CRONTAB_DIR = os.path.join(root, 'etc/cron.d')
+    generator.PARTS_DIR = os.path.join(root, 'etc/cron.%s')
+    generator.ANACRONTAB = os.path.join(root, 'etc/anacrontab')
+    generator.STATEDIR = os.path.join(root, 'var/spool/cron')
+    generator.CACHEDIR = os.path.join(root, 'var/cache/systemd-cron')
+    generator.MANIFEST = os.path.join(generator.CACHEDIR, 'manifest.json')
+    generator.REBOOT_FILE = os.path.join(root, 'run/crond.reboot')
+    generator.TARGET_DIR = target
+    generator.TIMERS_DIR = os.path.join(target, 'cron.target.wants')
+    generator.stats.enabled = True
+    generator.stagger.configure()
+
+    phases = Phases()
+    # the generator calls the names it imported from the library,
+    # the user crontabs go through parse_crontab_cached when there is no pool
+    for name in ('parse_crontab', 'parse_crontab_cached'):
+        setattr(parser, name, phases.wrap_iterator('parse', getattr(parser, name)))
+        setattr(generator, name, phases.wrap_iterator('parse', getattr(generator, name)))
+    generator.parse_user_crontabs = phases.wrap('parse', generator.parse_user_crontabs)
+    generator.is_masked = phases.wrap('is_masked', generator.is_masked)
+    generator.Job.output = phases.wrap('output', generator.Job.output)
+    generator.Output.write = phases.wrap('write', generator.Output.write)
+    generator.Manifest.__init__ = phases.wrap('manifest', generator.Manifest.__init__)
+    generator.Manifest.save = phases.wrap('manifest', generator.Manifest.save)
+
+    generator.main()
+
+    json.dump({
+        'phases': phases.finish(),
+        'counters': generator.stats.counters,
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }, sys.stdout)
+
+def startup(crontab:str, pycache:str) -> float:
+    '''load the parser in a new interpreter, then read one crontab, like crontab(1)'''
+    script = ('import sys, time\n'
+              'start = time.perf_counter()\n'
+              'sys.path.insert(0, %r)\n'
+              'import systemd_cron\n'
+              'list(systemd_cron.parse_crontab(%r, withuser=False))\n'
+              'print(time.perf_counter() - start)\n' % (LIB_DIR, crontab))
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.run([sys.executable, '-c', script], env=env,
+                          stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return float(proc.stdout)
+
+def count_files(target:str) -> int:
+    return sum(len(files) for _, _, files in os.walk(target))
+
+def run(root:str, target:str, verbose:bool) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', root, target],
+                          stdout=subprocess.PIPE,
+                          stderr=None if verbose else subprocess.DEVNULL,
+                          universal_newlines=True, check=True)
+    report = json.loads(proc.stdout)
+    report['wall'] = time.perf_counter() - start
+    report['files'] = count_files(target)
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--crond', type=int, default=50, help='files in /etc/cron.d')
+    parser.add_argument('--users', type=int, default=500, help='user crontabs')
+    parser.add_argument('--parts', type=int, default=10, help='scripts in /etc/cron.daily')
+    parser.add_argument('--lines', type=int, default=20, help='lines per crontab')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    parser.add_argument('--verbose', action='store_true', help='show the generator logs')
+    parser.add_argument('--startup', type=int, metavar='N',
+                        help='time N crontab startups instead of the generator')
+    parser.add_argument('--child', nargs=2, metavar=('ROOT', 'TARGET'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    root = tempfile.mkdtemp(prefix='systemd-cron-benchmark.')
+    try:
+        populate(root, args)
+        if args.startup:
+            crontab = os.path.join(root, 'var/spool/cron/user0')
+            pycache = os.path.join(root, 'pycache')
+            reports = {'cold': [], 'warm': []}
+            for _ in range(args.startup):
+                shutil.rmtree(pycache, ignore_errors=True)
+                reports['cold'].append(startup(crontab, pycache))
+                reports['warm'].append(startup(crontab, pycache))
+        else:
+            target = os.path.join(root, 'generator')
+            os.mkdir(target)
+            reports = {'cold': run(root, target, args.verbose),
+                       'warm': run(root, target, args.verbose)}
+    finally:
+        shutil.rmtree(root)
+
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+        return
+
+    if args.startup:
+        for name, timings in reports.items():
+            timings.sort()
+            print('%s: %.1fms median, %.1fms min over %d runs' %
+                  (name, 1000 * timings[len(timings) // 2], 1000 * timings[0], len(timings)))
+        return
+
+    for name, report in reports.items():
+        print('%s: %.3fs wall, %d files emitted, peak RSS %d KiB' %
+              (name, report['wall'], report['files'], report['maxrss']))
+        for phase, duration in sorted(report['phases'].items(), key=lambda item: -item[1]):
+            print('    %-10s %8.3fs' % (phase, duration))
+        print('    ' + ' '.join('%s=%d' % item for item in sorted(report['counters'].items())))
+
+if __name__ == '__main__':
+    main()
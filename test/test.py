@@ -1,10 +1,22 @@
 #!/usr/bin/python3
+import contextlib
 import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
 import unittest
+import unittest.mock
+
+sys.path.insert(0, 'src/lib/systemd-cron')
 
 # https://github.com/wntrblm/nox/pull/498
 
 def m():
+    # the generator then imports a fresh copy of the shared parser too
+    sys.modules.pop('systemd_cron', None)
     loader = importlib.machinery.SourceFileLoader('name',
                 'src/bin/systemd-crontab-generator.py')
     return loader.load_module()
@@ -27,7 +39,480 @@ class TestStringMethods(unittest.TestCase):
         j = m().Job('-', '1 * * * mon-wed dummy true')
         j.parse_crontab_timespec(withuser=True)
         j.generate_schedule()
-        self.assertEqual(j.schedule, 'Mon,Tue,Wed *-*-* *:1:00')
+        self.assertEqual(j.schedule, 'Mon..Wed *-*-* *:1:00')
+
+    def test_timespec_list(self):
+        j = m().Job('-', '0,1,2,3,30 1-5,9 * jan,feb fri-7 dummy true')
+        j.parse_crontab_timespec(withuser=True)
+        j.generate_schedule()
+        self.assertEqual(j.schedule, 'Fri..Sun *-1,2-* 1..5,9:0..3,30:00')
+
+    def test_timespec_repeat(self):
+        j = m().Job('-', '*/5 */2 * * * dummy true')
+        j.parse_crontab_timespec(withuser=True)
+        j.generate_schedule()
+        self.assertEqual(j.schedule, '*-*-* 0/2:0/5:00')
+
+    def test_timespec_keyword(self):
+        j = m().Job('-', '0 0 1 */3 * dummy true')
+        j.parse_crontab_timespec(withuser=True)
+        j.generate_schedule()
+        self.assertEqual(j.schedule, 'quarterly')
+
+    def test_environment_shared(self):
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('FOO=bar\n'
+                    '* * * * * root true\n'
+                    '* * * * * root false\n'
+                    'DELAY=5\n'
+                    '* * * * * root true\n')
+            f.flush()
+            jobs = list(m().parse_crontab(f.name))
+        self.assertIs(jobs[0].environment, jobs[1].environment)
+        self.assertEqual(jobs[2].environment, {'FOO': 'bar'})
+        self.assertEqual(jobs[2].boot_delay, 5)
+        self.assertEqual([j.lineno for j in jobs], [2, 3, 5])
+
+    def test_which_crontab_path(self):
+        g = m()
+        with tempfile.TemporaryDirectory() as bindir:
+            with open(bindir + '/true', 'w') as f:
+                f.write('#!/bin/sh\n')
+            g.os.chmod(bindir + '/true', 0o755)
+            self.assertEqual(g.systemd_cron.which('true', bindir + ':/bin'), bindir + '/true')
+            self.assertIsNone(g.systemd_cron.which('no-such-program', bindir))
+
+    def test_masked_empty_file(self):
+        g = m()
+        with tempfile.TemporaryDirectory() as unitdir:
+            open(unitdir + '/foo.timer', 'w').close()
+            g.UNIT_DIRS = [unitdir]
+            self.assertTrue(g.is_masked('foo', {}))
+            self.assertFalse(g.is_masked('bar', {}))
+
+    def test_parsed_cache(self):
+        g = m()
+        with tempfile.TemporaryDirectory() as cachedir, \
+             tempfile.NamedTemporaryFile('w') as f:
+            g.systemd_cron.PARSED_DIR = cachedir
+            f.write('PERSISTENT=yes\n'
+                    '*/5 * * * * echo one\n'
+                    '@daily echo two\n')
+            f.flush()
+            fresh = [(j.user, j.schedule, j.persistent, j.command) for j in g.parse_crontab_cached(f.name)]
+            cached = [(j.user, j.schedule, j.persistent, j.command) for j in g.parse_crontab_cached(f.name)]
+            if g.os.geteuid() == 0:
+                self.assertEqual(len(g.os.listdir(cachedir)), 1)
+        self.assertEqual(fresh, cached)
+        self.assertEqual(fresh[0][1:], ('*-*-* *:0/5:00', True, ['echo', 'one']))
+
+    def test_parsed_cache_messages(self):
+        g = m()
+        logged = []
+        g.systemd_cron.log = lambda level, message: logged.append(message)
+        g.stats.enabled = True
+        with tempfile.TemporaryDirectory() as cachedir, \
+             tempfile.NamedTemporaryFile('w') as f:
+            g.systemd_cron.PARSED_DIR = cachedir
+            f.write('RANDOM_DELAY=soon\n'
+                    '61 * * * * echo garbled\n'
+                    '@daily echo fine\n')
+            f.flush()
+            list(g.parse_crontab_cached(f.name))
+            fresh = list(logged)
+            logged.clear()
+            list(g.parse_crontab_cached(f.name))
+            if g.os.geteuid() == 0:
+                self.assertEqual(g.systemd_cron.stats.counters.get('parsed_cache_hits'), 1)
+        self.assertTrue(any('invalid RANDOM_DELAY' in message for message in fresh))
+        self.assertTrue(any('garbled time' in message for message in fresh))
+        self.assertEqual(logged, fresh)
+
+    def test_stable_names(self):
+        g = m()
+        g.STABLE_NAMES = g.systemd_cron.STABLE_NAMES = True
+        names = []
+        for crontab in ('0 1 * * * root echo one\n'
+                        '0 1 * * * root echo one\n',
+                        '0 0 * * * root echo zero\n'
+                        '0 1 * * * root echo one\n'
+                        '0 1 * * * root echo one\n'):
+            with tempfile.TemporaryDirectory() as folder:
+                with open(folder + '/stable', 'w') as f:
+                    f.write(crontab)
+                g.seqs.clear()
+                g.names.clear()
+                source = g.Source(f.name)
+                for job in g.parse_crontab(f.name):
+                    g.generate_timer_unit(job, source)
+            names.append(sorted(name for name in source.units if name.endswith('.timer')))
+        self.assertEqual(len(names[0]), 2)
+        self.assertTrue(names[0][0].endswith('-1.timer'))
+        self.assertTrue(set(names[0]) < set(names[1]))
+
+    def test_native_boot_delay(self):
+        g = m()
+        g.systemd_cron.NATIVE_BOOT_DELAY = True
+        g.TARGET_DIR = g.systemd_cron.TARGET_DIR = '/run/systemd/generator'
+        g.TIMERS_DIR = g.TARGET_DIR + '/cron.target.wants'
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('DELAY=5\n'
+                    '@daily root echo late\n'
+                    'DELAY=0\n'
+                    '@daily root echo early\n')
+            f.flush()
+            source = g.Source(f.name)
+            for job in g.parse_crontab(f.name):
+                g.generate_timer_unit(job, source)
+        output = g.Output()
+        output.add(source)
+        self.assertIn('OnBootSec=5m', output.units['cron-delay-5.timer'])
+        self.assertIn('cron-delay-5.target', output.units)
+        wants = sorted(link.split('/')[-2] for link in output.links)
+        self.assertEqual(wants, ['cron-delay-5.target.wants', 'cron.target.wants', 'cron.target.wants'])
+        self.assertFalse(any('boot_delay' in unit for unit in output.units.values()))
+
+    def test_stagger(self):
+        g = m()
+        g.stagger.minutes = 5
+        timers = {}
+        for name in ('cron-a.timer', 'cron-b.timer', 'cron-c.timer'):
+            timers[name] = g.stagger.shift(name, '[Timer]\nOnCalendar=hourly\nPersistent=true\n')
+        self.assertEqual(timers['cron-a.timer'], g.stagger.shift('cron-a.timer', '[Timer]\nOnCalendar=hourly\nPersistent=true\n'))
+        self.assertEqual(len(set(timers.values())), 3)
+        self.assertIn('OnCalendar=*-*-* *:', timers['cron-a.timer'])
+        self.assertIn('AccuracySec=1s', timers['cron-a.timer'])
+        shifted = g.stagger.shift('cron-d.timer', '[Timer]\nOnCalendar=*-*-* *:0/15:00\n')
+        self.assertRegex(shifted, r'OnCalendar=\*-\*-\* \*:0/15:[0-5][0-9]\n')
+        self.assertEqual(g.stagger.shift('cron-e.timer', '[Timer]\nOnCalendar=hourly\nAccuracySec=10m\n'),
+                         '[Timer]\nOnCalendar=hourly\nAccuracySec=10m\n')
+        self.assertEqual(g.stagger.peaks(g.stagger.before)[0], 5)
+        self.assertLess(g.stagger.peaks(g.stagger.after)[0], 5)
+
+    def test_slices(self):
+        g = m()
+        with tempfile.TemporaryDirectory() as folder:
+            with open(folder + '/slices.conf', 'w') as f:
+                f.write('*       CPU_WEIGHT=50 MAX_JOBS=4\n'
+                        'root    CPU_WEIGHT=200 IO_WEIGHT=lots\n')
+            with open(folder + '/crontab', 'w') as f:
+                f.write('MAX_JOBS=2\n'
+                        'MEMORY_MAX=1G\n'
+                        '@daily root echo one\n')
+            g.systemd_cron.SLICES_CONF = folder + '/slices.conf'
+            source = g.Source(f.name)
+            for job in g.parse_crontab(f.name):
+                g.generate_timer_unit(job, source)
+        self.assertEqual(g.systemd_cron.slice_name('a-b'), 'cron-a\\x2db')
+        self.assertIn('CPUWeight=200', source.units['cron-root.slice'])
+        self.assertNotIn('IOWeight', source.units['cron-root.slice'])
+        service = [unit for name, unit in source.units.items() if name.endswith('.service')][0]
+        self.assertIn('Slice=cron-root.slice', service)
+        self.assertIn('MemoryMax=1G', service)
+        self.assertIn('job_slot 2 /run/cron-slots/root ', service)
+        self.assertNotIn('MEMORY_MAX', service)
+
+    def test_aggregate_probes(self):
+        g = m()
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('AGGREGATE=yes\n'
+                    '0 1 * * * root /missing/tool\n')
+            f.flush()
+            source = g.Source(f.name)
+            for job in g.parse_crontab(f.name):
+                g.generate_timer_unit(job, source)
+            g.generate_group_units(source)
+        self.assertEqual(source.probes, {'/missing/tool': False})
+
+    def test_aggregate(self):
+        g = m()
+        g.TARGET_DIR = g.systemd_cron.TARGET_DIR = '/run/systemd/generator'
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('AGGREGATE=yes\n'
+                    '*/5 * * * * root echo one\n'
+                    '0 1 * * * root echo two\n'
+                    '*/5 * * * * root echo three\n')
+            f.flush()
+            source = g.Source(f.name)
+            for job in g.parse_crontab(f.name):
+                g.generate_timer_unit(job, source)
+            g.generate_group_units(source)
+        timers = [name for name in source.units if name.endswith('.timer')]
+        self.assertEqual(len(timers), 2)
+        group = [name for name in source.units if '-group-' in name and name.endswith('.sh')]
+        self.assertEqual(len(group), 1)
+        self.assertIn('echo one', source.units[group[0]])
+        self.assertIn('echo three', source.units[group[0]])
+
+class TestMailOnFailure(unittest.TestCase):
+
+    def bounded(self, lines, head, tail, max_bytes):
+        loader = importlib.machinery.SourceFileLoader('mail_on_failure', 'src/bin/mail_on_failure.py')
+        stream = io.BytesIO(b''.join(b'%s\n' % line for line in lines))
+        return loader.load_module().bounded(stream, head, tail, max_bytes).splitlines()
+
+    def test_head_tail(self):
+        lines = [b'line %d' % i for i in range(100)]
+        self.assertEqual(self.bounded(lines, 2, 3, 65536),
+                         ['line 0', 'line 1', '[... 95 lines skipped ...]', 'line 97', 'line 98', 'line 99'])
+        self.assertEqual(self.bounded(lines[:4], 2, 3, 65536), ['line 0', 'line 1', 'line 2', 'line 3'])
+        self.assertEqual(self.bounded(lines, 0, 1, 65536), ['[... 99 lines skipped ...]', 'line 99'])
+
+    def test_max_bytes(self):
+        lines = [b'%03d ' % i + b'x' * 96 for i in range(100)]
+        # cut at 80 bytes, 11 of those fit
+        logs = self.bounded(lines, 0, 20, 1000)
+        self.assertEqual(logs[0], '[... 89 lines skipped ...]')
+        self.assertEqual([line[:3] for line in logs[1:]], ['%03d' % i for i in range(89, 100)])
+        self.assertLessEqual(sum(len(line) + 1 for line in logs[1:]), 1000)
+        # a huge line is cut, and leaves room for the others
+        logs = self.bounded([b'y' * 100000, b'last'], 0, 10, 1000)
+        self.assertEqual(logs[0], 'y' * 100 + ' [...]')
+        self.assertEqual(logs[1], 'last')
+
+class TestUpdateUnits(unittest.TestCase):
+    '''the timers touched after a reload, in --dry-run'''
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        loader = importlib.machinery.SourceFileLoader('update_units', 'src/bin/update_units.py')
+        self.u = loader.load_module()
+        self.u.TARGET_DIR = self.tmp.name
+        self.u.TIMERS_DIR = os.path.join(self.tmp.name, 'cron.target.wants')
+        os.makedirs(self.u.TIMERS_DIR)
+        os.makedirs(os.path.join(self.tmp.name, 'cron-delay-5.target.wants'))
+        self.write('cron.target.wants/cron-root-0.timer', '[Timer]\nOnCalendar=hourly\n')
+        self.write('cron.target.wants/cron-root-1.timer', '[Timer]\nOnCalendar=daily\n')
+        self.write('cron.target.wants/cron-root-1.service', '[Service]\n')
+        self.write('cron-delay-5.target.wants/cron-root-2.timer', '[Timer]\nOnBootSec=5m\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        with open(os.path.join(self.tmp.name, path), 'w') as f:
+            f.write(content)
+
+    def update(self, before, after, active):
+        self.u.cron_active = lambda: active
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            result = self.u.update(before, after, True)
+        return result, out.getvalue().splitlines()
+
+    def test_snapshot(self):
+        self.assertEqual(sorted(self.u.snapshot()), ['cron-root-0.timer', 'cron-root-1.timer', 'cron-root-2.timer'])
+
+    def test_diff(self):
+        before = self.u.snapshot()
+        os.remove(os.path.join(self.tmp.name, 'cron.target.wants/cron-root-0.timer'))
+        self.write('cron.target.wants/cron-root-1.timer', '[Timer]\nOnCalendar=weekly\n')
+        self.write('cron-delay-5.target.wants/cron-root-3.timer', '[Timer]\nOnBootSec=5m\n')
+        after = self.u.snapshot()
+        self.assertEqual(self.u.diff(before, after),
+                         (['cron-root-0.timer'], ['cron-root-3.timer'], ['cron-root-1.timer']))
+        self.assertEqual(self.update(before, after, True),
+                         ((['cron-root-0.timer'], ['cron-root-3.timer'], ['cron-root-1.timer']),
+                          ['systemctl stop cron-root-0.timer',
+                           'systemctl restart cron-root-1.timer',
+                           'systemctl start cron-root-3.timer']))
+        # nothing is started while cron is stopped
+        self.assertEqual(self.update(before, after, False),
+                         ((['cron-root-0.timer'], [], []), ['systemctl stop cron-root-0.timer']))
+        self.assertEqual(self.update(after, after, True), (([], [], []), []))
+
+class TestManifest(unittest.TestCase):
+    '''two runs of the generator against the same fake root and output folder'''
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for folder in ('etc/cron.d', 'var/spool/cron', 'var/cache/systemd-cron', 'run', 'generator'):
+            os.makedirs(os.path.join(self.root, folder))
+        self.write('etc/crontab', 'MAILTO=admin\n0 1 * * * root echo crontab\n')
+        self.write('etc/cron.d/package', '*/5 * * * * root echo package\n'
+                   '0 2 * * * root test -x %s/bin/tool && %s/bin/tool\n' % (self.root, self.root))
+        self.write('var/spool/cron/root', '0 * * * * echo user\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        with open(os.path.join(self.root, path), 'w') as f:
+            f.write(content)
+
+    def run_generator(self, g=None):
+        '''like a new process; returns how many jobs were parsed'''
+        g = g or m()
+        g.CRONTAB = self.root + '/etc/crontab'
+        g.CRONTAB_DIR = self.root + '/etc/cron.d'
+        g.PARTS_DIR = self.root + '/etc/cron.%s'
+        g.ANACRONTAB = self.root + '/etc/anacrontab'
+        g.UNIT_DIRS = [self.root + '/lib/systemd/system']
+        g.STATEDIR = g.systemd_cron.STATEDIR = self.root + '/var/spool/cron'
+        g.CACHEDIR = g.systemd_cron.CACHEDIR = self.root + '/var/cache/systemd-cron'
+        g.MANIFEST = g.CACHEDIR + '/manifest.json'
+        g.REBOOT_FILE = g.systemd_cron.REBOOT_FILE = self.root + '/run/crond.reboot'
+        g.TARGET_DIR = g.systemd_cron.TARGET_DIR = self.root + '/generator'
+        g.TIMERS_DIR = g.TARGET_DIR + '/cron.target.wants'
+        g.systemd_cron.PARSED_DIR = ''
+        g.stats.enabled = True
+        g.main()
+        return g.stats.counters.get('jobs_parsed', 0)
+
+    def output(self):
+        files = {}
+        for folder, _, names in os.walk(self.root + '/generator'):
+            for name in names:
+                path = os.path.join(folder, name)
+                if os.path.islink(path):
+                    files[path] = os.readlink(path)
+                else:
+                    with open(path) as f:
+                        files[path] = f.read()
+        return files
+
+    def test_unchanged(self):
+        self.assertEqual(self.run_generator(), 4)
+        first = self.output()
+        self.assertEqual(self.run_generator(), 0)
+        self.assertEqual(self.output(), first)
+
+    def test_modified_crontab(self):
+        self.run_generator()
+        self.write('etc/cron.d/package', '*/5 * * * * root echo changed\n')
+        self.assertEqual(self.run_generator(), 1)
+        self.assertTrue(any('echo changed' in content for content in self.output().values()))
+
+    def test_same_content(self):
+        self.run_generator()
+        self.write('etc/cron.d/package', '*/5 * * * * root echo package\n'
+                   '0 2 * * * root test -x %s/bin/tool && %s/bin/tool\n' % (self.root, self.root))
+        self.assertEqual(self.run_generator(), 0)
+
+    def test_probe(self):
+        self.run_generator()
+        self.assertFalse(any('bin/tool' in content for content in self.output().values()))
+        os.makedirs(self.root + '/bin')
+        self.write('bin/tool', '#!/bin/sh\n')
+        os.chmod(self.root + '/bin/tool', 0o755)
+        self.assertEqual(self.run_generator(), 2)
+        self.assertTrue(any('ConditionFileIsExecutable=%s/bin/tool' % self.root in content
+                            for content in self.output().values()))
+
+    def test_mailto(self):
+        self.run_generator()
+        # /etc/crontab itself, then /etc/cron.d/package for the new fallback
+        self.write('etc/crontab', 'MAILTO=other\n0 1 * * * root echo crontab\n')
+        self.assertEqual(self.run_generator(), 3)
+
+    def test_passwd(self):
+        self.run_generator()
+        g = m()
+        file_version = g.file_version
+        g.file_version = lambda path: [0, 0] if path == '/etc/passwd' else file_version(path)
+        self.assertEqual(self.run_generator(g), 4)
+
+    def test_corrupt(self):
+        self.run_generator()
+        first = self.output()
+        with open(self.root + '/var/cache/systemd-cron/manifest.json', 'r+') as f:
+            f.truncate(100)
+        self.assertEqual(self.run_generator(), 4)
+        self.assertEqual(self.output(), first)
+        self.write('var/cache/systemd-cron/manifest.json', '{"version": 3, "context": {}}')
+        self.assertEqual(self.run_generator(), 4)
+        self.assertEqual(self.output(), first)
+
+    def test_write(self):
+        self.write('etc/cron.d/package', '*/5 * * * * root echo one\n'
+                   '0 4 * * * root echo two\n')
+        self.run_generator()
+        target = self.root + '/generator'
+        inodes = {name: os.stat(os.path.join(target, name)).st_ino
+                  for name in os.listdir(target) if name.startswith('cron-')}
+        self.assertIn('cron-package-root-1.timer', inodes)
+        os.mkdir(target + '/.systemd-cron.interrupted')
+        self.write('etc/cron.d/package', '*/5 * * * * root echo edited\n')
+        self.run_generator()
+        after = {name: os.stat(os.path.join(target, name)).st_ino
+                 for name in os.listdir(target) if name.startswith('cron-')}
+        self.assertEqual(set(after), {name for name in inodes if not name.startswith('cron-package-root-1.')})
+        self.assertFalse(os.path.lexists(target + '/cron.target.wants/cron-package-root-1.timer'))
+        self.assertFalse([name for name in os.listdir(target) if name.startswith('.systemd-cron.')])
+        changed = sorted(name for name in after if after[name] != inodes[name])
+        self.assertEqual(changed, ['cron-package-root-0.service', 'cron-package-root-0.sh',
+                                   'cron-package-root-0.timer'])
+        with open(target + '/cron-package-root-0.service') as f:
+            self.assertIn('echo edited', f.read())
+
+    def test_dry_run(self):
+        os.makedirs(self.root + '/etc/systemd-cron')
+        self.write('etc/systemd-cron/slices.conf', '*  CPU_WEIGHT=50\n')
+        g = m()
+        g.DRY_RUN = True
+        g.systemd_cron.SLICES_CONF = self.root + '/etc/systemd-cron/slices.conf'
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            self.run_generator(g)
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        units = {record['unit']: record for record in records}
+        self.assertEqual(len(units), len(records))
+        self.assertNotIn('cron-root', units)
+        user = units['cron-root-root-0']
+        self.assertEqual(user['source'], self.root + '/var/spool/cron/root:1')
+        self.assertIn('OnCalendar=hourly', user['timer'])
+        self.assertIn('Slice=cron-root.slice', user['service'])
+        self.assertIn('CPUWeight=50', user['slice'])
+        self.assertTrue(all(record['slice'] == user['slice'] for record in records))
+        self.assertEqual(os.listdir(self.root + '/generator'), [])
+
+    def test_stable_names_shared_jobid(self):
+        # both have the jobid root-root
+        self.write('etc/cron.d/root', '0 3 * * * root echo same\n')
+        self.write('var/spool/cron/root', '0 3 * * * echo same\n')
+        wants = self.root + '/generator/cron.target.wants'
+        runs = []
+        for _ in range(2):
+            g = m()
+            g.STABLE_NAMES = g.systemd_cron.STABLE_NAMES = True
+            parsed = self.run_generator(g)
+            runs.append((parsed, sorted(name for name in os.listdir(wants) if name.startswith('cron-root-root-'))))
+        self.assertEqual(runs[0][0], 5)
+        self.assertEqual(len(runs[0][1]), 2)
+        # the user crontab depends on /etc/cron.d/root, and is not replayed
+        self.assertEqual(runs[1], (1, runs[0][1]))
+
+    def test_claim(self):
+        self.run_generator()
+        # takes the jobid of the user crontab of root, that cannot be replayed anymore
+        self.write('etc/cron.d/root', '0 3 * * * root echo other\n')
+        self.assertEqual(self.run_generator(), 2)
+        timers = [name for name in os.listdir(self.root + '/generator/cron.target.wants')
+                  if name.startswith('cron-root-root-')]
+        self.assertEqual(len(timers), 2)
+        self.assertEqual(self.run_generator(), 1)
+        self.assertEqual(sorted(name for name in os.listdir(self.root + '/generator/cron.target.wants')
+                                if name.startswith('cron-root-root-')), sorted(timers))
+
+    def test_workers(self):
+        # the job of /etc/cron.d/root takes the jobid of the user crontab of root,
+        # so that one is parsed again serially
+        self.write('etc/cron.d/root', '0 3 * * * root echo other\n')
+        self.write('var/spool/cron/alice', '0 4 * * * echo same\n@daily echo alice\n')
+        self.write('var/spool/cron/bob', '0 4 * * * echo same\n@daily echo bob\n')
+        g = m()
+        g.PARALLEL_MIN = 10**9
+        self.run_generator(g)
+        serial = self.output()
+
+        shutil.rmtree(self.root + '/generator')
+        os.makedirs(self.root + '/generator')
+        os.remove(self.root + '/var/cache/systemd-cron/manifest.json')
+        g = m()
+        g.PARALLEL_MIN = 1
+        with unittest.mock.patch('os.cpu_count', return_value=2):
+            # the job of the user crontab of root is parsed twice
+            self.assertEqual(self.run_generator(g), 10)
+        self.assertEqual(self.output(), serial)
 
 if __name__ == '__main__':
     unittest.main()